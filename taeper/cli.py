@@ -4,7 +4,7 @@
 import sys
 import argparse
 import logging
-from taeper import taeper
+from taeper import profiling, taeper
 
 LOGGING_LEVELS = {
     0: "NOTSET",
@@ -29,20 +29,204 @@ def check_positive(value: str):
     return fvalue
 
 
-def main():
-    """Generate the cli for taeper and pass args to main program."""
+def check_non_negative(value: str):
+    """Ensures the value given is a non-negative number.
+
+    :param value: A string of a number
+    :return: A non-negative float. Raises an error if value is negative
+    """
+    fvalue = float(value)
+    if fvalue < 0:
+        raise argparse.ArgumentTypeError(
+            "{} is an invalid non-negative float value".format(value))
+    return fvalue
+
+
+def check_non_negative_int(value: str):
+    """Ensures the value given is a non-negative integer.
+
+    :param value: A string of an integer
+    :return: A non-negative int. Raises an error if value is negative
+    """
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError(
+            "{} is an invalid non-negative int value".format(value))
+    return ivalue
+
+
+def check_positive_int(value: str):
+    """Ensures the value given is a positive integer.
+
+    :param value: A string of an integer
+    :return: A positive int. Raises an error if value is not positive
+    """
+    ivalue = int(value)
+    if ivalue <= 0:
+        raise argparse.ArgumentTypeError(
+            "{} is an invalid positive int value".format(value))
+    return ivalue
+
+
+def check_shard(value: str):
+    """Parses a shard given as i/N, where i is the zero-based shard number and
+    N is the number of shards.
+
+    :param value: A string of the form i/N
+    :return: Tuple of (i, N). Raises an error if value is not a valid shard.
+    """
+    try:
+        shard_num, num_shards = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{} is an invalid shard. Expected the form i/N".format(value))
+    if num_shards <= 0 or not 0 <= shard_num < num_shards:
+        raise argparse.ArgumentTypeError(
+            "{} is an invalid shard. i must be in the range [0, N)".format(
+                value))
+    return shard_num, num_shards
+
+
+def add_input_dir_argument(parser: argparse.ArgumentParser):
+    """Adds the input directory option to a parser."""
+    parser.add_argument(
+        "-i", "--input_dir",
+        help="Directory where files are located. May also be a tar archive "
+             "(uncompressed, gzip or zstd) of fast5 files. Reads can only be "
+             "deposited from uncompressed archives.",
+        type=str,
+        required=True)
+
+
+def add_dump_index_argument(parser: argparse.ArgumentParser):
+    """Adds the option for where to save the index to a parser."""
+    parser.add_argument(
+        "-d", "--dump_index",
+        help="Path to save index as. Default is 'taeper_index.npy' in current "
+             "working directory. Note: Paths in the index are relative to the "
+             "current working directory.",
+        default='taeper_index.npy',
+        type=str)
+
+
+def add_log_level_argument(parser: argparse.ArgumentParser):
+    """Adds the logging level option to a parser."""
+    parser.add_argument(
+        "--log_level",
+        help="Level of logging. 0 is none, 5 is for debugging. Default is 4 "
+             "which will report info, warnings, errors, and critical "
+             "information.",
+        default=4,
+        type=int,
+        choices=range(6))
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Adds the profiling options to a parser."""
+    parser.add_argument(
+        "--profile",
+        help="Time each stage of the program (scanning, reading fast5 files, "
+             "sorting, saving, copying etc.) and print a breakdown of the "
+             "total, mean and p99 time per stage to stderr when finished.",
+        action='store_true')
+
+    parser.add_argument(
+        "--profile_dir",
+        help="Also run each stage under cProfile and write its statistics "
+             "to <profile_dir>/<stage>.pstats. Implies --profile.",
+        type=str)
+
+
+def index_parser() -> argparse.ArgumentParser:
+    """Generate the cli for the index subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="taeper index",
+        description="Build an index of the fast5 files in a directory without "
+                    "depositing them. Use --shard to index only a "
+                    "deterministic subset of the files, which can later be "
+                    "combined with 'taeper merge-index'.")
+
+    add_input_dir_argument(parser)
+    add_dump_index_argument(parser)
+
+    parser.add_argument(
+        "--shard",
+        help="Only index the files in shard i of N, given as i/N. i is "
+             "zero-based. Files are assigned to shards by a hash of their "
+             "path relative to input_dir.",
+        type=check_shard)
+
+    add_log_level_argument(parser)
+    add_profile_arguments(parser)
+    parser.set_defaults(func=taeper.main, index=None, output=None,
+                        no_index=False, dry_run=False)
+    return parser
+
+
+def merge_index_parser() -> argparse.ArgumentParser:
+    """Generate the cli for the merge-index subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="taeper merge-index",
+        description="Merge several index files of the same input directory "
+                    "or archive, such as those produced with 'taeper index "
+                    "--shard', into a single sorted index.")
+
+    parser.add_argument(
+        "indexes",
+        help="Index files to merge.",
+        type=str,
+        nargs='+')
+
+    add_dump_index_argument(parser)
+    add_log_level_argument(parser)
+    add_profile_arguments(parser)
+    parser.set_defaults(func=taeper.merge)
+    return parser
+
+
+def stats_parser() -> argparse.ArgumentParser:
+    """Generate the cli for the stats subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="taeper stats",
+        description="Report the throughput profile of a run from its index, "
+                    "without reading any fast5 files: reads per time bin, "
+                    "cumulative reads, the pass/fail split over time and the "
+                    "distribution of time between reads.")
+
+    parser.add_argument(
+        "index",
+        help="Index file of the run.",
+        type=str)
+
+    parser.add_argument(
+        "--bin_secs",
+        help="Width of each time bin in seconds. (Default = 60)",
+        type=check_positive,
+        default=60.0)
+
+    parser.add_argument(
+        "--csv",
+        help="Only output the per-bin table, as CSV.",
+        action='store_true')
+
+    add_log_level_argument(parser)
+    add_profile_arguments(parser)
+    parser.set_defaults(func=taeper.stats)
+    return parser
+
+
+def simulate_parser() -> argparse.ArgumentParser:
+    """Generate the cli for simulating a run."""
     parser = argparse.ArgumentParser(
         description="Simulate the real-time depositing of Nanopore "
                     "reads into a given folder, conserving the order they "
                     "were processed during sequencing. If pass and fail "
                     "folders do not exist in output_dir they will be created "
-                    "if detected in the file path for the fast5 file.")
+                    "if detected in the file path for the fast5 file. "
+                    "Subcommands: {}. Run 'taeper <subcommand> --help' for "
+                    "their usage.".format(", ".join(SUBCOMMANDS)))
 
-    parser.add_argument(
-        "-i", "--input_dir",
-        help="Directory where files are located.",
-        type=str,
-        required=True)
+    add_input_dir_argument(parser)
 
     parser.add_argument(
         "--index",
@@ -66,13 +250,70 @@ def main():
         default=1.0)
 
     parser.add_argument(
-        "-d", "--dump_index",
-        help="Path to save index as. Default is 'taeper_index.npy' in current "
-             "working directory. Note: Paths in the index are relative to the "
-             "current working directory.",
-        default='taeper_index.npy',
+        "--prefetch_reads",
+        help="Number of upcoming reads whose files are warmed into the page "
+             "cache before they are deposited. Useful when input_dir is on "
+             "slow storage. (Default = 0)",
+        type=check_non_negative_int,
+        default=0)
+
+    parser.add_argument(
+        "--prefetch_secs",
+        help="Warm the files of all reads due to be deposited within this "
+             "many seconds (after scaling). Combined with --prefetch_reads, "
+             "whichever looks further ahead is used. (Default = 0)",
+        type=check_non_negative,
+        default=0.0)
+
+    parser.add_argument(
+        "--amplify",
+        help="Deposit each read this many times, to generate more load than "
+             "the original run. Extra copies get unique file names and, "
+             "unless made by hardlink, unique read IDs. (Default = 1)",
+        type=check_positive_int,
+        default=1)
+
+    parser.add_argument(
+        "--amplify_jitter",
+        help="Extra copies of a read are deposited at a random time up to "
+             "this many seconds (before scaling) either side of the original. "
+             "(Default = 1.0)",
+        type=check_non_negative,
+        default=1.0)
+
+    parser.add_argument(
+        "--amplify_method",
+        help="How extra copies of a read are made. Reflinks (btrfs, XFS) "
+             "share unchanged data. Hardlinks cost no space but share the "
+             "input file's content, so keep the original read ID. Falls back "
+             "to copying if a link cannot be made, e.g. from a tar archive. "
+             "Every copy that is not a hardlink is given a unique read ID. "
+             "(Default = reflink)",
+        choices=taeper.AMPLIFY_METHODS,
+        default='reflink')
+
+    parser.add_argument(
+        "--seed",
+        help="Seed for the random jitter of amplified reads.",
+        type=int)
+
+    parser.add_argument(
+        "--dry_run",
+        help="Run the replay schedule on a virtual clock without waiting or "
+             "copying any files, and report the deposit timeline: total "
+             "duration, reads and bytes per minute, peak burst rate and "
+             "longest gaps. Does not require --output.",
+        action='store_true'
+    )
+
+    parser.add_argument(
+        "--timeline_csv",
+        help="With --dry_run, also write the reads and bytes deposited in "
+             "each minute of the replay to this file, as CSV.",
         type=str)
 
+    add_dump_index_argument(parser)
+
     parser.add_argument(
         "--no_index",
         help="Dont write the index list to file. This will mean it needs "
@@ -80,14 +321,8 @@ def main():
         action='store_true'
     )
 
-    parser.add_argument(
-        "--log_level",
-        help="Level of logging. 0 is none, 5 is for debugging. Default is 4 "
-             "which will report info, warnings, errors, and critical "
-             "information.",
-        default=4,
-        type=int,
-        choices=range(6))
+    add_log_level_argument(parser)
+    add_profile_arguments(parser)
 
     parser.add_argument(
         "--no_progress_bar",
@@ -95,7 +330,36 @@ def main():
         action='store_true'
     )
 
-    args = parser.parse_args()
+    parser.set_defaults(func=taeper.main, shard=None)
+    return parser
+
+
+SUBCOMMANDS = {
+    'index': index_parser,
+    'merge-index': merge_index_parser,
+    'stats': stats_parser,
+}
+
+
+def report_profile():
+    """Prints the stage timings to stderr and writes any cProfile output."""
+    sys.stderr.write(profiling.PROFILER.report() + "\n")
+    for path in profiling.PROFILER.dump_cprofiles():
+        logging.info(" cProfile statistics saved as: {}".format(path))
+
+
+def main(argv=None):
+    """Generate the cli for taeper and pass args to main program."""
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in SUBCOMMANDS:
+        parser = SUBCOMMANDS[argv[0]]()
+        argv = argv[1:]
+    else:
+        parser = simulate_parser()
+
+    args = parser.parse_args(argv)
 
     # setup logging
     log_level = LOGGING_LEVELS.get(args.log_level)
@@ -103,8 +367,15 @@ def main():
                         format='[%(asctime)s]:%(levelname)s:%(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p')
 
+    if args.profile or args.profile_dir:
+        profiling.PROFILER.enable(cprofile_dir=args.profile_dir)
+
     # it's business time
-    taeper.main(args)
+    try:
+        args.func(args)
+    finally:
+        if profiling.PROFILER.enabled:
+            report_profile()
     return 0
 
 
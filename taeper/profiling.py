@@ -0,0 +1,196 @@
+"""Low overhead timing of the stages of indexing and replay."""
+import cProfile
+import math
+import os
+import time
+from typing import List
+
+# durations are counted in log-spaced buckets, so memory stays constant no
+# matter how many reads are timed. 20 buckets per decade from 1us to 1000s
+# gives percentiles to within about 12%.
+BUCKETS_PER_DECADE = 20
+MIN_BUCKET_SECS = 1e-6
+NUM_BUCKETS = 9 * BUCKETS_PER_DECADE + 1
+
+
+def _bucket(secs: float) -> int:
+    """Finds the histogram bucket a duration falls in."""
+    if secs <= MIN_BUCKET_SECS:
+        return 0
+    bucket = int(math.log10(secs / MIN_BUCKET_SECS) * BUCKETS_PER_DECADE) + 1
+    return min(bucket, NUM_BUCKETS - 1)
+
+
+def _bucket_upper_bound(bucket: int) -> float:
+    """Gives the largest duration that falls in a histogram bucket."""
+    return MIN_BUCKET_SECS * 10 ** (bucket / BUCKETS_PER_DECADE)
+
+
+class StageStats:
+    """Running statistics of the time spent in one stage."""
+    __slots__ = ('calls', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def add(self, secs: float):
+        """Records one call of the stage.
+
+        :param secs: time the call took.
+        """
+        self.calls += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+        self.buckets[_bucket(secs)] += 1
+
+    @property
+    def mean(self) -> float:
+        """Mean seconds per call."""
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Approximates a percentile of the call durations.
+
+        :param q: percentile to compute, between 0 and 100.
+        :return: the upper bound of the bucket holding the percentile, capped
+        at the longest call.
+        """
+        threshold = self.calls * q / 100
+        count = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            count += bucket_count
+            if count >= threshold and count > 0:
+                return min(_bucket_upper_bound(bucket), self.max)
+        return self.max
+
+
+class _StageTimer:
+    """Context manager timing one call of a stage."""
+    __slots__ = ('profiler', 'name', 'start', 'profile')
+
+    def __init__(self, profiler: 'StageProfiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = self.profiler._start_cprofile(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        secs = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._active_cprofile = None
+        self.profiler.record(self.name, secs)
+
+
+class _NullTimer:
+    """Context manager that does nothing, used when profiling is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageProfiler:
+    """Collects the time spent in named stages. Disabled by default, in which
+    case timing a stage costs a single function call.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cprofile_dir = None
+        self.stats = {}
+        self._cprofiles = {}
+        self._active_cprofile = None
+
+    def enable(self, cprofile_dir: str = None):
+        """Starts collecting stage timings.
+
+        :param cprofile_dir: if given, each stage is also run under cProfile
+        and its statistics written to <cprofile_dir>/<stage>.pstats.
+        """
+        self.enabled = True
+        self.cprofile_dir = cprofile_dir
+
+    def stage(self, name: str):
+        """Times a stage. Use as a context manager.
+
+        :param name: name of the stage.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def record(self, name: str, secs: float):
+        """Records one call of a stage.
+
+        :param name: name of the stage.
+        :param secs: time the call took.
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = StageStats()
+        stats.add(secs)
+
+    def _start_cprofile(self, name: str):
+        # only one cProfile can be active, so nested stages are counted in
+        # the outermost stage's profile
+        if self.cprofile_dir is None or self._active_cprofile is not None:
+            return None
+        profile = self._cprofiles.get(name)
+        if profile is None:
+            profile = self._cprofiles[name] = cProfile.Profile()
+        self._active_cprofile = profile
+        profile.enable()
+        return profile
+
+    def dump_cprofiles(self) -> List[str]:
+        """Writes the cProfile statistics of each stage to cprofile_dir.
+
+        :return: paths of the files written.
+        """
+        if self.cprofile_dir is None:
+            return []
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        paths = []
+        for name, profile in self._cprofiles.items():
+            path = os.path.join(self.cprofile_dir, "{}.pstats".format(name))
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def report(self) -> str:
+        """Formats the time spent in each stage as a table, longest total
+        first. Percentiles are approximate."""
+        header = "{:<24} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+            "stage", "calls", "total (s)", "mean (ms)", "p99 (ms)",
+            "max (ms)")
+        lines = [header]
+        ordered = sorted(self.stats.items(), key=lambda item: item[1].total,
+                         reverse=True)
+        for name, stats in ordered:
+            lines.append(
+                "{:<24} {:>10} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.3f}".format(
+                    name, stats.calls, stats.total, stats.mean * 1000,
+                    stats.percentile(99) * 1000, stats.max * 1000))
+        return "\n".join(lines)
+
+
+PROFILER = StageProfiler()
+
+
+# times a stage with the global profiler. bound directly, rather than wrapped,
+# to keep the cost of a disabled timer to one call.
+stage = PROFILER.stage
@@ -1,5 +1,7 @@
 """Command line program to simulate the rerunning of a nanopore experiment."""
 import warnings
+import array
+import io
 import numpy as np
 import os
 import sys
@@ -7,15 +9,165 @@ import shutil
 import time
 import logging
 import pathlib
+import tarfile
+import threading
+import uuid
+import zipfile
+import zlib
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
-from typing import Generator, List, Tuple
+from typing import (BinaryIO, Callable, Generator, List, NamedTuple,
+                    Optional, Tuple)
+from taeper import profiling
 
 # suppress annoying warning coming from this libraries use of h5py
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
+    import h5py
     from ont_fast5_api import fast5_file as fast5
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 EXTENSION = '.fast5'
+WARM_CHUNK_SIZE = 1 << 20
+AMPLIFY_METHODS = ('hardlink', 'reflink', 'copy')
+# ioctl request number for cloning a file on Linux
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1 << 20
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# suffixes of compressed tar archives, which share an index with the
+# decompressed archive
+COMPRESSED_TAR_SUFFIXES = ('.tar.gz', '.tgz', '.tar.zst', '.tar.zstd',
+                           '.tzst')
+READ_CLASSES = ('unclassified', 'pass', 'fail')
+INTER_ARRIVAL_PERCENTILES = (50, 90, 99)
+
+
+class PathStore:
+    """Compact storage for a large number of file paths. Paths are split into
+    a table of distinct directories, which each path refers to by number, and
+    a file name stored as UTF-8 bytes. Full paths are only rebuilt when they
+    are accessed, so memory grows with the number of directories rather than
+    the total length of the paths.
+
+    :param directories: sorted array of the distinct directories.
+    :param directory_ids: position in directories of each path's directory.
+    :param names: UTF-8 encoded file name of each path.
+    """
+    def __init__(self, directories: np.ndarray, directory_ids: np.ndarray,
+                 names: np.ndarray):
+        self.directories = directories
+        self.directory_ids = directory_ids
+        self.names = names
+
+    @classmethod
+    def from_paths(cls, paths) -> 'PathStore':
+        """Builds a store from an iterable of paths.
+
+        :param paths: the paths to store.
+        :return: A PathStore holding the paths in the same order.
+        """
+        # number directories as they are first seen, so only the distinct
+        # ones are ever held as strings
+        ids = {}
+        id_list, basenames = array.array('i'), []
+        for path in paths:
+            dirname, basename = os.path.split(str(path))
+            id_list.append(ids.setdefault(dirname, len(ids)))
+            basenames.append(basename.encode())
+
+        # sort the table so directory numbers are also their ranks
+        directories = np.array(list(ids), dtype=str)
+        order = np.argsort(directories, kind='mergesort')
+        ranks = np.empty(len(order), dtype=np.int32)
+        ranks[order] = np.arange(len(order), dtype=np.int32)
+        directory_ids = ranks[np.frombuffer(id_list, dtype=np.intc)]
+        return cls(directories[order], directory_ids,
+                   np.array(basenames, dtype=bytes))
+
+    @classmethod
+    def concatenate(cls, stores: List['PathStore']) -> 'PathStore':
+        """Joins several stores into one, merging their directory tables.
+
+        :param stores: the stores to join.
+        :return: A PathStore holding the paths of each store in turn.
+        """
+        directories, directory_ids = np.unique(
+            np.concatenate([store.directories for store in stores]),
+            return_inverse=True)
+
+        # map each store's directory numbers to numbers in the merged table
+        ids, start = [], 0
+        for store in stores:
+            end = start + len(store.directories)
+            ids.append(directory_ids[start:end][store.directory_ids])
+            start = end
+
+        return cls(directories, np.concatenate(ids).astype(np.int32),
+                   np.concatenate([store.names for store in stores]))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, key):
+        """Rebuilds the path at an integer position, or selects a subset of
+        the store for a slice, mask or array of positions."""
+        if isinstance(key, (int, np.integer)):
+            directory = self.directories[self.directory_ids[key]]
+            return os.path.join(str(directory), self.names[key].decode())
+        return PathStore(self.directories, self.directory_ids[key],
+                         self.names[key])
+
+    def __iter__(self) -> Generator:
+        for directory_id, name in zip(self.directory_ids.tolist(),
+                                      self.names.tolist()):
+            yield os.path.join(str(self.directories[directory_id]),
+                               name.decode())
+
+    def tolist(self) -> List[str]:
+        """Rebuilds all paths in the store."""
+        return list(self)
+
+    def sort_keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Gets keys that sort the paths by directory, then file name, for use
+        with numpy.lexsort.
+
+        :return: Tuple of the file names and directory ranks, least
+        significant first.
+        """
+        # directories are kept sorted, so their numbers are also their ranks
+        return self.names, self.directory_ids
+
+
+# An index holds the epoch time each read finished sequencing, sorted in
+# ascending order, alongside a PathStore of the fast5 file for each read, and
+# the size in bytes of each read's file. When the reads are members of a tar
+# archive, offsets give the location of each member's data within the
+# (uncompressed) archive, otherwise they are None. root is the directory or
+# archive the index was built from. Indexes written by older versions record
+# neither sizes nor root, so these are None.
+Index = NamedTuple('Index', [('timestamps', np.ndarray),
+                             ('paths', PathStore),
+                             ('offsets', Optional[np.ndarray]),
+                             ('sizes', Optional[np.ndarray]),
+                             ('root', Optional[str])])
+Index.__new__.__defaults__ = (None, None, None)
+
+# A schedule holds the time each read is due to be deposited, sorted in
+# ascending order, alongside the position in the index of the read to deposit
+# and which copy of that read it is, when reads are deposited more than once.
+Schedule = NamedTuple('Schedule', [('timestamps', np.ndarray),
+                                   ('sources', np.ndarray),
+                                   ('copies', np.ndarray)])
 
 
 def _zulu_to_epoch_time(zulu_time: str) -> float:
@@ -25,20 +177,24 @@ def _zulu_to_epoch_time(zulu_time: str) -> float:
     return (time_as_date - epoch).total_seconds()
 
 
-def extract_time_fields(filepath: str) -> dict:
+def extract_time_fields(filepath: str, fileobj: BinaryIO = None) -> dict:
     """Extracts the time from a given fast5 file.
 
     :param filepath: full path to fast5 file.
+    :param fileobj: seekable file object to read the fast5 file from instead
+    of opening filepath.
 
     :returns fields: a dictionary containing the read start time,
     experiment start time, duration of read, and sampling rate of the
     channel.
 
     """
-    fast5_info = fast5.Fast5Info(filepath)
-    fast5_file = fast5.Fast5File(filepath)
-    exp_start_time = fast5_file.get_tracking_id().get('exp_start_time')
-    sampling_rate = fast5_file.get_channel_info().get('sampling_rate')
+    source = filepath if fileobj is None else fileobj
+    with profiling.stage('hdf5_read'):
+        fast5_info = fast5.Fast5Info(source)
+        fast5_file = fast5.Fast5File(source)
+        exp_start_time = fast5_file.get_tracking_id().get('exp_start_time')
+        sampling_rate = fast5_file.get_channel_info().get('sampling_rate')
 
     if sampling_rate is None:
         logging.warning(" {} missing 'sampling_rate' field. "
@@ -49,8 +205,11 @@ def extract_time_fields(filepath: str) -> dict:
                         "Skipping...".format(filepath))
         return {}
 
+    with profiling.stage('strptime'):
+        exp_start_epoch = _zulu_to_epoch_time(exp_start_time)
+
     fields = {
-        'exp_start_time': _zulu_to_epoch_time(exp_start_time),
+        'exp_start_time': exp_start_epoch,
         'sampling_rate': float(sampling_rate),
         'duration': float(fast5_info.read_info[0].duration),
         'start_time': float(fast5_info.read_info[0].start_time)
@@ -58,14 +217,16 @@ def extract_time_fields(filepath: str) -> dict:
     return fields
 
 
-def calculate_timestamp(filepath: str) -> float:
+def calculate_timestamp(filepath: str, fileobj: BinaryIO = None) -> float:
     """Calculates the epoch time when the read finished sequencing.
 
     :param filepath: full path to fast5 file
+    :param fileobj: seekable file object to read the fast5 file from instead
+    of opening filepath.
 
     :returns Epoch time that the read finished sequencing
     """
-    time_info = extract_time_fields(filepath)
+    time_info = extract_time_fields(filepath, fileobj)
 
     if time_info == {}:  # missing field(s) in fast5 file
         return 0.0
@@ -96,6 +257,88 @@ def scantree(path: str, ext: str) -> Generator:
             yield entry.path
 
 
+def is_compressed_archive(archive_path: str) -> bool:
+    """Checks whether an archive is gzip or zstd compressed.
+
+    :param archive_path: path to tar archive.
+    :return: True if the archive is compressed.
+    """
+    with open(archive_path, 'rb') as archive:
+        magic = archive.read(len(ZSTD_MAGIC))
+    return magic.startswith(GZIP_MAGIC) or magic == ZSTD_MAGIC
+
+
+@contextmanager
+def open_archive(archive_path: str) -> Generator:
+    """Opens a tar archive for reading its members in order. Uncompressed
+    archives are opened for random access, compressed ones are streamed.
+
+    :param archive_path: path to tar archive. May be uncompressed, gzip or,
+    if the zstandard package is installed, zstd compressed.
+    :return: Yields the open TarFile.
+    """
+    with open(archive_path, 'rb') as archive:
+        magic = archive.read(len(ZSTD_MAGIC))
+        archive.seek(0)
+        if magic == ZSTD_MAGIC:
+            if zstandard is None:
+                raise OSError("The zstandard package is required to read "
+                              "zstd compressed archives.")
+            reader = zstandard.ZstdDecompressor().stream_reader(archive)
+            with reader, tarfile.open(fileobj=reader, mode='r|') as tar:
+                yield tar
+        elif magic.startswith(GZIP_MAGIC):
+            with tarfile.open(fileobj=archive, mode='r|gz') as tar:
+                yield tar
+        else:
+            with tarfile.open(fileobj=archive, mode='r:') as tar:
+                yield tar
+
+
+class ArchiveMemberFile(io.BytesIO):
+    """The data of a tar archive member held in memory. The member's path is
+    reported as the file's path, as the fast5 API expects files have one.
+
+    :param data: the member's data.
+    :param filepath: path to the member.
+    """
+    def __init__(self, data: bytes, filepath: str):
+        super().__init__(data)
+        self.name = filepath
+
+    def __fspath__(self):
+        return self.name
+
+
+def is_safe_member_name(name: str) -> bool:
+    """Checks a tar archive member's name stays within the directory it is
+    deposited to, i.e. it is relative and has no '..' parts.
+
+    :param name: name of the member.
+    :return: True if the name is safe to join to an output directory.
+    """
+    return not (os.path.isabs(name)
+                or '..' in pathlib.PurePosixPath(name).parts)
+
+
+def iter_archive_members(tar: tarfile.TarFile) -> Generator:
+    """Iterates over the members of an open tar archive without keeping them
+    all in memory, as iterating a TarFile directly would.
+
+    :param tar: open tar archive.
+
+    :returns Yields the TarInfo for each member.
+    """
+    while True:
+        member = tar.next()
+        if member is None:
+            break
+        # members are not needed once read. dropping them keeps memory flat
+        # for archives with millions of files.
+        tar.members = []
+        yield member
+
+
 def generate_output_filepath(filepath: str, output_dir: str,
                              input_dir: str) -> pathlib.Path:
     """Creates the output path to write a file to, keeping the directory
@@ -133,115 +376,640 @@ def read_deposit(input_filepath: pathlib.Path, output_filepath: pathlib.Path):
     shutil.copy2(input_filepath, output_filepath)
 
 
-def get_timestamp_for_path(filepath: str) -> List:
-    """Gathers the timestamp for a file and returns it paired with the path.
+def archive_member_deposit(archive: BinaryIO, offset: int, size: int,
+                           output_filepath: pathlib.Path):
+    """Copies a member of an uncompressed tar archive to the output path. If
+    the directory to copy to does not exist, it is created, along with any
+    missing parents.
+
+    :param archive: open tar archive file.
+    :param offset: position of the member's data within the archive.
+    :param size: size of the member's data.
+    :param output_filepath: path to copy member to.
+    """
+    if not output_filepath.parent.exists():
+        output_filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    archive.seek(offset)
+    with open(output_filepath, 'wb') as output_file:
+        remaining = size
+        while remaining > 0:
+            chunk = archive.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError("Unexpected end of archive copying {}".format(
+                    output_filepath))
+            output_file.write(chunk)
+            remaining -= len(chunk)
+
+
+def warm_file(filepath: str, offset: int = 0, length: int = 0):
+    """Asks the OS to start reading a file into the page cache so a later copy
+    of it does not have to wait on slow storage. Where posix_fadvise is not
+    available the file is read through instead.
+
+    :param filepath: file to warm.
+    :param offset: start of the region of the file to warm.
+    :param length: length of the region to warm. 0 warms to the end of file.
+    """
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+                remaining = length or float('inf')
+                while remaining > 0:
+                    chunk = os.read(fd, int(min(WARM_CHUNK_SIZE, remaining)))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+        finally:
+            os.close(fd)
+    except OSError as err:
+        logging.debug(" Could not prefetch {}: {}".format(filepath, err))
+
+
+def prefetch_window_end(timestamps: np.ndarray, position: int,
+                        max_reads: int, max_secs: float) -> int:
+    """Finds where the prefetch window starting at a position ends. The window
+    covers the next max_reads reads, or all reads finishing within max_secs
+    of the read at position, whichever reaches further.
+
+    :param timestamps: sorted timestamps of the index.
+    :param position: index of the read about to be deposited.
+    :param max_reads: number of reads to look ahead.
+    :param max_secs: seconds of index time to look ahead.
+    :return: The (exclusive) end of the window.
+    """
+    if position >= len(timestamps):
+        return len(timestamps)
+
+    end = position + max_reads
+    if max_secs > 0:
+        time_end = np.searchsorted(timestamps, timestamps[position] + max_secs,
+                                   side='right')
+        end = max(end, int(time_end))
+    return min(end, len(timestamps))
+
+
+def warm_read(index_: Index, position: int, archive_path: str = None):
+    """Warms the file holding the read at a position in the index.
+
+    :param index_: index holding the read.
+    :param position: index of the read to warm.
+    :param archive_path: tar archive the index refers to, if any.
+    """
+    if index_.offsets is None:
+        warm_file(index_.paths[position])
+    else:
+        warm_file(archive_path, int(index_.offsets[position]),
+                  int(index_.sizes[position]))
+
+
+class Prefetcher:
+    """Warms upcoming source files on a background thread, ahead of them
+    being deposited.
+
+    :param timestamps: sorted times the reads being replayed are due.
+    :param warm: function called with the position in timestamps of each read
+    to warm.
+    :param max_reads: number of reads to look ahead.
+    :param max_secs: seconds of index time to look ahead.
+    """
+    def __init__(self, timestamps: np.ndarray, warm: Callable[[int], None],
+                 max_reads: int = 0, max_secs: float = 0.0):
+        self.timestamps = timestamps
+        self.warm = warm
+        self.max_reads = max_reads
+        self.max_secs = max_secs
+        self.enabled = ((max_reads > 0 or max_secs > 0)
+                        and len(timestamps) > 0)
+        self._position = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Starts warming files from the beginning of the index."""
+        if self.enabled:
+            self._thread.start()
+
+    def stop(self):
+        """Stops warming files and waits for the background thread."""
+        if not self.enabled:
+            return
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def advance(self, position: int):
+        """Moves the prefetch window to start at the given read.
+
+        :param position: index of the read about to be deposited.
+        """
+        if not self.enabled:
+            return
+        with self._condition:
+            self._position = position
+            self._condition.notify()
+
+    def _run(self):
+        num_reads = len(self.timestamps)
+        next_read = 0
+        while next_read < num_reads:
+            with self._condition:
+                while not self._stopped:
+                    # never warm files the replay has already moved past
+                    next_read = max(next_read, self._position)
+                    window_end = prefetch_window_end(
+                        self.timestamps, self._position,
+                        self.max_reads, self.max_secs)
+                    if next_read < window_end:
+                        break
+                    self._condition.wait()
+                if self._stopped:
+                    return
+            self.warm(next_read)
+            next_read += 1
+
+
+def get_timestamp_for_path(filepath: str, fileobj: BinaryIO = None) -> float:
+    """Gathers the timestamp for a file, guarding against unreadable files.
 
     :param filepath: Path to file.
-    :return: A list whose first element is the timestamp and second element
-    is the filepath. Returns an empty list if there is an issue with the file.
+    :param fileobj: seekable file object to read the file from instead of
+    opening filepath.
+    :return: The epoch time the read finished sequencing. Returns 0.0 if there
+    is an issue with the file.
     """
     try:
-        timestamp = calculate_timestamp(filepath)
-        if timestamp == 0:  # missing field(s) in fast5 file
-            return []
-        time_path_pair = [timestamp, filepath]
-        logging.debug(time_path_pair)
-        return time_path_pair
+        timestamp = calculate_timestamp(filepath, fileobj)
+        logging.debug([timestamp, filepath])
+        return timestamp
     except OSError as err:
         logging.warning(" {} not processed. Error "
                         "encountered: {}\n".format(filepath, err))
-        return []
+        return 0.0
 
 
-def filter_list(unfiltered_list: List) -> List:
-    """Filters empty lists and None's out of a list.
+def get_size_for_path(filepath: str) -> int:
+    """Gets the size of a file, guarding against unreadable files.
 
-    :param unfiltered_list: A list to filter.
-    :return: A list containing no empty lists or None's
+    :param filepath: Path to file.
+    :return: The size of the file in bytes. Returns 0 if there is an issue
+    with the file.
+    """
+    try:
+        return os.path.getsize(filepath)
+    except OSError as err:
+        logging.debug(" Could not get size of {}: {}".format(filepath, err))
+        return 0
+
+
+def build_index(timestamps: np.ndarray, paths: np.ndarray,
+                offsets: np.ndarray = None, sizes: np.ndarray = None,
+                root: str = None) -> Index:
+    """Drops invalid entries and sorts the remaining ones by timestamp.
+
+    :param timestamps: Epoch finish time for each file. A timestamp of 0
+    marks a file that could not be processed.
+    :param paths: Path to each file, in the same order as timestamps. Either
+    a PathStore or an iterable of paths.
+    :param offsets: Position of each file's data within a tar archive.
+    :param sizes: Size of each file, or of its data within a tar archive.
+    :param root: Directory or tar archive the files are within.
+    :return: An Index sorted in ascending order by time. Ties are broken on
+    the directory, then the file name.
     """
-    filtered_list = [element for element in unfiltered_list
-                     if element != [] and element is not None]
-    return filtered_list
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if not isinstance(paths, PathStore):
+        paths = PathStore.from_paths(paths)
 
+    valid = timestamps > 0
+    paths = paths[valid]
+    with profiling.stage('sort'):
+        order = np.lexsort(paths.sort_keys() + (timestamps[valid],))
 
-def centre_list(uncentred_list: List[List]) -> List[Tuple[float, str]]:
-    """Takes a list of lists and centres is on zero. That is each element is
-    turned into the difference between it and the previous element.
+    def select(array):
+        return array[valid][order]
 
-    :param uncentred_list: A sorted list.
-    :return: A list with first element 0 and each element the difference to the
-    previous one.
-    """
-    # unzip the list in order to use numpy ediff1d method
-    timestamps, paths = zip(*uncentred_list)
+    if offsets is not None:
+        offsets = select(np.asarray(offsets, dtype=np.int64))
+    if sizes is not None:
+        sizes = select(np.asarray(sizes, dtype=np.int64))
+
+    return Index(timestamps=select(timestamps), paths=paths[order],
+                 offsets=offsets, sizes=sizes, root=root)
 
-    # make the first read "time 0" and all others relative to that
-    zero_centered_times = np.ediff1d(timestamps, to_begin=0)
 
-    # zip times back with paths
-    return list(zip(zero_centered_times.round(decimals=3), paths))
+def compute_delays(timestamps: np.ndarray) -> np.ndarray:
+    """Centres sorted timestamps on zero. That is each element is turned into
+    the difference between it and the previous element.
 
+    :param timestamps: A sorted array of timestamps.
+    :return: An array with first element 0 and each element the difference to
+    the previous one, rounded to the millisecond.
+    """
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.float64)
+    # make the first read "time 0" and all others relative to that
+    delays = np.ediff1d(timestamps, to_begin=0)
+    return delays.round(decimals=3)
 
-def generate_index(input_dir: str) -> List[Tuple[float, str]]:
-    """Returns a list that is sorted in ascending order by time.
-    All timepoints are relative to the first entry which is time 0.
 
-    :param input_dir: Path to directory holding fast5 reads.
+def in_shard(filepath: str, input_dir: str, shard: Tuple[int, int]) -> bool:
+    """Determines whether a file belongs to a shard. Files are assigned by a
+    hash of their path relative to the input directory, so every node sharing
+    the same directory layout agrees on the partition.
 
-    :returns centred_list: List of tuples with first element being the time
-    delay relative to the previous and second element being the path to the
-    file.
+    :param filepath: Path to file.
+    :param input_dir: Directory the file is within.
+    :param shard: Tuple of the (zero-based) shard number and number of shards.
+    :return: True if the file belongs to the shard.
     """
-    fast5_paths = scantree(input_dir, EXTENSION)
-    paths_with_their_timestamps = [get_timestamp_for_path(filepath)
-                                   for filepath in fast5_paths]
+    shard_num, num_shards = shard
+    relative_path = os.path.relpath(filepath, input_dir)
+    return zlib.crc32(relative_path.encode()) % num_shards == shard_num
+
+
+def generate_index(input_dir: str,
+                   shard: Optional[Tuple[int, int]] = None) -> Index:
+    """Builds an index of all fast5 files under a directory, sorted in
+    ascending order by the time each read finished sequencing.
 
-    filtered_list = filter_list(paths_with_their_timestamps)
+    :param input_dir: Path to directory, or tar archive, holding fast5 reads.
+    :param shard: Tuple of the (zero-based) shard number and number of shards.
+    If given, only the files belonging to that shard are indexed.
 
-    if len(filtered_list) == 0:
+    :returns An Index of timestamps and paths. It is empty if no file could be
+    processed.
+    """
+    if os.path.isfile(input_dir):
+        index_ = generate_archive_index(input_dir, shard=shard)
+    else:
+        fast5_paths = scantree(input_dir, EXTENSION)
+        if shard is not None:
+            fast5_paths = (filepath for filepath in fast5_paths
+                           if in_shard(filepath, input_dir, shard))
+        with profiling.stage('scantree'):
+            fast5_paths = list(fast5_paths)
+
+        timestamps = np.fromiter((get_timestamp_for_path(filepath)
+                                  for filepath in fast5_paths),
+                                 dtype=np.float64, count=len(fast5_paths))
+        # recorded now, while the files are being read anyway, so the dry run
+        # need not look at every file again
+        sizes = np.fromiter((get_size_for_path(filepath)
+                             for filepath in fast5_paths),
+                            dtype=np.int64, count=len(fast5_paths))
+
+        index_ = build_index(timestamps, fast5_paths, sizes=sizes,
+                             root=input_root(input_dir))
+
+    if len(index_.timestamps) == 0:
         logging.error(" List of timestamps is empty. This likely means there "
                       "are missing fields in your fast5 files.")
-        return []
-
-    # todo: benchmark other sorting algorithms
-    filtered_list.sort()
 
-    zero_centred_list = centre_list(filtered_list)
-    return zero_centred_list
+    return index_
 
 
-def load_index(index_path: str) -> List[Tuple[float, str]]:
-    """Load in the index file and get into required format.
+def input_root(input_dir: str) -> str:
+    """Gives the root an index of a directory or tar archive records. A
+    compressed archive has the same root as the archive decompressed, so an
+    index of either can be replayed from the decompressed archive.
 
-    :param index_path: path to index
-    :return: List of tuples with first element being the time delay relative
-    to the previous and second element being the path to the file.
+    :param input_dir: Path to directory, or tar archive, holding fast5 reads.
+    :return: The normalised path, with any compression suffix of an archive
+    replaced by .tar.
+    """
+    root = os.path.normpath(input_dir)
+    if os.path.isfile(root):
+        for suffix in COMPRESSED_TAR_SUFFIXES:
+            if root.endswith(suffix):
+                return root[:-len(suffix)] + '.tar'
+    return root
+
+
+def generate_archive_index(archive_path: str,
+                           shard: Optional[Tuple[int, int]] = None) -> Index:
+    """Builds an index of all fast5 files within a tar archive, sorted in
+    ascending order by the time each read finished sequencing. Paths in the
+    index are the member names, relative to the archive, so the index of a
+    compressed archive is also valid for the archive decompressed.
+
+    :param archive_path: Path to tar archive holding fast5 reads.
+    :param shard: Tuple of the (zero-based) shard number and number of shards.
+    If given, only the files belonging to that shard are indexed.
+
+    :returns An Index of timestamps, paths and the location of each file's
+    data within the (uncompressed) archive.
+    """
+    paths, timestamps, offsets, sizes = [], [], [], []
+
+    with open_archive(archive_path) as tar:
+        for member in iter_archive_members(tar):
+            if not (member.isfile() and member.name.endswith(EXTENSION)):
+                continue
+            if not is_safe_member_name(member.name):
+                logging.warning(" {} in {} would be deposited outside the "
+                                "output directory. Skipping...".format(
+                                    member.name, archive_path))
+                continue
+            if shard is not None and not in_shard(member.name, os.curdir,
+                                                  shard):
+                continue
+
+            # fast5 files are small, so read them whole. this also allows
+            # compressed archives, whose members can only be read in order.
+            filepath = os.path.join(archive_path, member.name)
+            with profiling.stage('archive_read'):
+                fileobj = ArchiveMemberFile(tar.extractfile(member).read(),
+                                            filepath)
+
+            paths.append(member.name)
+            timestamps.append(get_timestamp_for_path(filepath, fileobj))
+            offsets.append(member.offset_data)
+            sizes.append(member.size)
+
+    return build_index(timestamps, paths, offsets, sizes,
+                       root=input_root(archive_path))
+
+
+def merge_indexes(indexes: List[Index]) -> Index:
+    """Combines several indexes of the same directory or tar archive, such as
+    the shards of an index, into a single index sorted by timestamp.
+
+    :param indexes: The indexes to merge. They must all record the same root,
+    so indexes written by older versions, which record none, cannot be
+    merged.
+    :return: An Index containing every entry of the given indexes.
     """
-    index_list = np.load(index_path)
-    formatted_list = [(float(delay), path) for (delay, path) in index_list]
-    return formatted_list
+    if not indexes:
+        return build_index([], [])
+
+    roots = {index_.root for index_ in indexes}
+    if None in roots:
+        raise ValueError("Cannot merge indexes written by older versions of "
+                         "taeper. Rebuild them first.")
+    if len(roots) > 1:
+        raise ValueError("Cannot merge indexes of different inputs: "
+                         "{}.".format(", ".join(sorted(roots))))
+    root = roots.pop()
+
+    from_archive = [index_.offsets is not None for index_ in indexes]
+    if any(from_archive) and not all(from_archive):
+        raise ValueError("Cannot merge indexes of tar archives with indexes "
+                         "of directories.")
+
+    timestamps = np.concatenate([index_.timestamps for index_ in indexes])
+    paths = PathStore.concatenate([index_.paths for index_ in indexes])
+    offsets = sizes = None
+    if all(from_archive):
+        offsets = np.concatenate([index_.offsets for index_ in indexes])
+    if all(index_.sizes is not None for index_ in indexes):
+        sizes = np.concatenate([index_.sizes for index_ in indexes])
+    return build_index(timestamps, paths, offsets, sizes, root=root)
+
+
+def save_index(index_path: str, index_: Index):
+    """Writes an index to file as a collection of numpy arrays.
+
+    :param index_path: path to save index as.
+    :param index_: the index to save.
+    """
+    arrays = {
+        'timestamps': index_.timestamps,
+        'directories': index_.paths.directories,
+        'directory_ids': index_.paths.directory_ids,
+        'names': index_.paths.names
+    }
+    if index_.offsets is not None:
+        arrays.update(offsets=index_.offsets)
+    if index_.sizes is not None:
+        arrays.update(sizes=index_.sizes)
+    if index_.root is not None:
+        arrays.update(root=np.array(index_.root))
 
+    # writing to a file object stops numpy appending a .npz extension
+    with profiling.stage('save_index'), open(index_path, 'wb') as index_file:
+        np.savez(index_file, **arrays)
 
-def index(args):
+
+def load_index(index_path: str) -> Index:
+    """Load in the index file and get into required format. Index files
+    written by older versions, which store a delay and a path per row as
+    strings, are also accepted.
+
+    :param index_path: path to index
+    :return: The Index stored in the file.
+    """
+    with profiling.stage('load_index'):
+        arrays = np.load(index_path, allow_pickle=False)
+
+    if isinstance(arrays, np.ndarray):  # legacy [delay, path] string rows
+        delays = arrays[:, 0].astype(np.float64)
+        return Index(timestamps=np.cumsum(delays),
+                     paths=PathStore.from_paths(arrays[:, 1]))
+
+    with arrays:
+        paths = PathStore(arrays['directories'], arrays['directory_ids'],
+                          arrays['names'])
+        offsets = sizes = root = None
+        if 'offsets' in arrays:
+            offsets = arrays['offsets']
+        if 'sizes' in arrays:
+            sizes = arrays['sizes']
+        if 'root' in arrays:
+            root = str(arrays['root'])
+
+        return Index(timestamps=arrays['timestamps'], paths=paths,
+                     offsets=offsets, sizes=sizes, root=root)
+
+
+def index(args) -> Index:
     """Handles the index step of the program."""
     if not args.index:  # build index
         logging.info(" Building index...")
-        index_list = generate_index(args.input_dir)
+        try:
+            index_ = generate_index(args.input_dir, shard=args.shard)
+        except (tarfile.TarError, OSError) as err:
+            logging.error(" Could not read {}: {} Exiting...".format(
+                args.input_dir, err))
+            return
 
-        if not index_list:  # list is empty
+        if len(index_.timestamps) == 0:
             logging.error(" Empty index. Exiting...")
             return
 
         logging.info(" Index built!")
 
         if not args.no_index:  # save index
-            np.save(args.dump_index, index_list)
+            save_index(args.dump_index, index_)
             logging.info(" Index saved as: {}".format(args.dump_index))
 
-        return index_list
+        return index_
     else:  # load index from file
-        index_list = load_index(args.index)
-        return index_list
+        return load_index(args.index)
+
+
+def merge(args):
+    """Handles merging partial index files into a single index."""
+    logging.info(" Merging {} index files...".format(len(args.indexes)))
+    indexes = []
+    for index_path in args.indexes:
+        try:
+            indexes.append(load_index(index_path))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+            logging.error(" Could not read index {}: {} Exiting...".format(
+                index_path, err))
+            return
+
+    try:
+        index_ = merge_indexes(indexes)
+    except ValueError as err:
+        logging.error(" {} Exiting...".format(err))
+        return
+
+    if len(index_.timestamps) == 0:
+        logging.error(" Merged index is empty. Exiting...")
+        return
+
+    save_index(args.dump_index, index_)
+    logging.info(" Merged index of {} files saved as: {}".format(
+        len(index_.timestamps), args.dump_index))
+
+
+def read_classes(paths: PathStore) -> np.ndarray:
+    """Classifies each read by whether it is within a pass or fail folder.
+    Only the distinct directories are inspected, not every path.
+
+    :param paths: paths of the reads.
+    :return: position in READ_CLASSES of each read's class.
+    """
+    directory_classes = np.zeros(len(paths.directories), dtype=np.int64)
+    for i, directory in enumerate(paths.directories.tolist()):
+        parts = pathlib.PurePath(directory).parts
+        for class_num, read_class in enumerate(READ_CLASSES[1:], start=1):
+            if read_class in parts:
+                directory_classes[i] = class_num
+                break
+    return directory_classes[paths.directory_ids]
+
+
+def run_profile(index_: Index, bin_secs: float = 60.0) -> dict:
+    """Profiles the throughput of a sequencing run from its index.
+
+    :param index_: index of the run.
+    :param bin_secs: width in seconds of each time bin.
+    :return: dictionary of the start (in seconds from the first read) of each
+    time bin, the reads finishing in each bin, in total and for each read
+    class, the cumulative reads at the end of each bin, the run duration, and
+    summary statistics of the time between consecutive reads.
+    """
+    timestamps = index_.timestamps
+    num_classes = len(READ_CLASSES)
+
+    if len(timestamps) == 0:
+        elapsed = np.zeros(0)
+        num_bins = 0
+    else:
+        elapsed = timestamps - timestamps[0]
+        num_bins = int(elapsed[-1] // bin_secs) + 1
+    bins = (elapsed // bin_secs).astype(np.int64)
+    inter_arrival = np.diff(timestamps)
+
+    # count reads per (bin, class) pair in a single pass
+    pairs = bins * num_classes + read_classes(index_.paths)
+    counts = np.bincount(pairs, minlength=num_bins * num_classes)
+    counts = counts.reshape(num_bins, num_classes)
+    reads = counts.sum(axis=1)
+
+    profile = {
+        'bin_starts': np.arange(num_bins) * bin_secs,
+        'reads': reads,
+        'cumulative_reads': np.cumsum(reads),
+        'duration': float(elapsed[-1]) if num_bins else 0.0,
+        'inter_arrival': {}
+    }
+    for class_num, read_class in enumerate(READ_CLASSES):
+        profile[read_class] = counts[:, class_num]
+
+    if len(inter_arrival) > 0:
+        summary = profile['inter_arrival']
+        summary['mean'] = float(inter_arrival.mean())
+        percentiles = np.percentile(inter_arrival, INTER_ARRIVAL_PERCENTILES)
+        for q, value in zip(INTER_ARRIVAL_PERCENTILES, percentiles):
+            summary['p{}'.format(q)] = float(value)
+        summary['max'] = float(inter_arrival.max())
+    return profile
+
+
+PROFILE_COLUMNS = ('bin_start', 'reads', 'cumulative_reads') + READ_CLASSES
+
+
+def profile_rows(profile: dict) -> Generator:
+    """Yields the rows of the per-bin profile table, in the order of
+    PROFILE_COLUMNS."""
+    columns = [profile['bin_starts'], profile['reads'],
+               profile['cumulative_reads']]
+    columns += [profile[read_class] for read_class in READ_CLASSES]
+    for row in zip(*(column.tolist() for column in columns)):
+        yield row
+
+
+def format_profile(profile: dict, csv: bool = False) -> str:
+    """Formats a run profile as a summary and an aligned table, or as CSV.
+
+    :param profile: profile from run_profile.
+    :param csv: only output the per-bin table, as CSV.
+    :return: the formatted profile.
+    """
+    if csv:
+        lines = [",".join(PROFILE_COLUMNS)]
+        lines += [",".join(str(value) for value in row)
+                  for row in profile_rows(profile)]
+        return "\n".join(lines)
+
+    total_reads = int(profile['reads'].sum())
+    lines = [
+        "Reads: {}".format(total_reads),
+        "Duration: {:.2f} minutes".format(profile['duration'] / 60)
+    ]
+    lines += ["{}: {}".format(read_class.capitalize(),
+                              int(profile[read_class].sum()))
+              for read_class in READ_CLASSES]
+    if profile['inter_arrival']:
+        lines.append("Seconds between reads: " + ", ".join(
+            "{} {:.3f}".format(name, value)
+            for name, value in profile['inter_arrival'].items()))
+
+    width = max(len(column) for column in PROFILE_COLUMNS)
+    row_format = " ".join("{:>%d}" % width for _ in PROFILE_COLUMNS)
+    lines.append(row_format.format(*PROFILE_COLUMNS))
+    lines += [row_format.format(*row) for row in profile_rows(profile)]
+    return "\n".join(lines)
+
+
+def stats(args):
+    """Handles reporting the throughput profile of a run from its index."""
+    index_ = load_index(args.index)
+
+    if len(index_.timestamps) == 0:
+        logging.error(" Empty index. Exiting...")
+        return
+
+    with profiling.stage('run_profile'):
+        profile = run_profile(index_, bin_secs=args.bin_secs)
+    print(format_profile(profile, csv=args.csv))
 
 
 def update_progress(progress: float):
@@ -270,27 +1038,423 @@ def update_progress(progress: float):
     sys.stdout.flush()
 
 
-def simulate_read_generation(args, index_list):
+class SystemClock:
+    """Clock that follows real (monotonic) time."""
+    def now(self) -> float:
+        """Current time in seconds."""
+        return time.monotonic()
+
+    def sleep(self, secs: float):
+        """Waits for the given number of seconds."""
+        time.sleep(secs)
+
+
+class VirtualClock:
+    """Clock whose time only moves forward when it sleeps, so a replay
+    scheduled on it runs without waiting.
+
+    :param start: time the clock starts at.
+    """
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def now(self) -> float:
+        """Current time in seconds."""
+        return self.time
+
+    def sleep(self, secs: float):
+        """Advances the clock by the given number of seconds."""
+        self.time += max(0.0, secs)
+
+
+def schedule_offsets(timestamps: np.ndarray, scale: float) -> np.ndarray:
+    """Calculates when each read is due relative to the start of the replay.
+
+    :param timestamps: sorted timestamps of the index.
+    :param scale: amount to speed the replay up by.
+    :return: seconds after the start of the replay each read is due.
+    """
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.float64)
+    # offsets come straight from the timestamps, rather than summing rounded
+    # delays, so rounding error cannot accumulate over a long run
+    return (timestamps - timestamps[0]) / scale
+
+
+def amplify_schedule(timestamps: np.ndarray, factor: int = 1,
+                     jitter: float = 0.0, seed: int = None) -> Schedule:
+    """Schedules each read in an index to be deposited factor times. The
+    first copy of a read keeps its original time, while the extra copies are
+    moved by a random amount of up to jitter seconds either side of it.
+
+    :param timestamps: sorted timestamps of the index.
+    :param factor: number of times to deposit each read.
+    :param jitter: largest number of (index) seconds an extra copy is moved.
+    :param seed: seed for the random jitter.
+    :return: The Schedule, sorted by time.
+    """
+    num_reads = len(timestamps)
+    sources = np.tile(np.arange(num_reads), factor)
+    copies = np.repeat(np.arange(factor), num_reads)
+    schedule_timestamps = timestamps[sources]
+
+    if factor > 1 and jitter > 0:
+        rng = np.random.default_rng(seed)
+        extra = copies > 0
+        schedule_timestamps[extra] += rng.uniform(-jitter, jitter,
+                                                  size=int(extra.sum()))
+
+    # stable sort, so without jitter the copies of a read stay in copy order
+    order = np.argsort(schedule_timestamps, kind='mergesort')
+    return Schedule(timestamps=schedule_timestamps[order],
+                    sources=sources[order], copies=copies[order])
+
+
+def amplified_filepath(filepath: pathlib.Path,
+                       copy_num: int) -> pathlib.Path:
+    """Gives the extra copies of a read a unique file name.
+
+    :param filepath: output path of the read.
+    :param copy_num: which copy of the read this is. 0 is the original.
+    :return: the path with the copy number appended to the file name, or the
+    path unchanged for the original.
+    """
+    if copy_num == 0:
+        return filepath
+    return filepath.with_name("{}_amp{}{}".format(filepath.stem, copy_num,
+                                                  filepath.suffix))
+
+
+def temporary_filepath(filepath: pathlib.Path) -> pathlib.Path:
+    """Gives the hidden, temporary name a file is written under before being
+    moved into place. The name does not end in the fast5 extension, so it is
+    ignored by anything watching for reads.
+
+    :param filepath: path the file is moved to once written.
+    :return: the temporary path, in the same directory as filepath.
+    """
+    return filepath.with_name(".{}.tmp".format(filepath.name))
+
+
+def clone_file(input_filepath: str, output_filepath: pathlib.Path):
+    """Creates a copy-on-write clone (reflink) of a file. Only supported on
+    Linux, by filesystems such as btrfs and XFS.
+
+    :param input_filepath: file to clone.
+    :param output_filepath: path of the clone.
+    """
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform.")
+
+    with open(input_filepath, 'rb') as input_file, \
+            open(output_filepath, 'wb') as output_file:
+        fcntl.ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+
+
+def link_deposit(input_filepath: str, output_filepath: pathlib.Path,
+                 method: str) -> bool:
+    """Deposits an extra copy of a read by hardlink, reflink or copy. If a
+    link cannot be made, e.g. because the output is on another filesystem,
+    the file is copied instead.
+
+    :param input_filepath: file to deposit.
+    :param output_filepath: path to deposit the file to.
+    :param method: one of AMPLIFY_METHODS.
+    :return: True if the deposited file is a hardlink, sharing its content
+    with the input file.
+    """
+    if not output_filepath.parent.exists():
+        output_filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        if method == 'hardlink':
+            os.link(input_filepath, output_filepath)
+            return True
+        if method == 'reflink':
+            clone_file(input_filepath, output_filepath)
+            return False
+    except OSError as err:
+        logging.debug(" Could not {} {}, copying instead: {}".format(
+            method, input_filepath, err))
+
+    shutil.copy2(input_filepath, output_filepath)
+    return False
+
+
+def rewrite_read_id(filepath: pathlib.Path, copy_num: int):
+    """Gives the reads in an extra copy of a fast5 file new read IDs. The new
+    IDs are derived from the original ID and the copy number, so they are
+    the same between runs.
+
+    :param filepath: fast5 file to rewrite.
+    :param copy_num: which copy of the read this is.
+    """
+    with h5py.File(filepath, 'r+') as handle:
+        for read in handle.get('Raw/Reads', {}).values():
+            read_id = read.attrs.get('read_id')
+            if read_id is None:
+                continue
+            if isinstance(read_id, bytes):
+                read_id = read_id.decode()
+            new_id = str(uuid.uuid5(uuid.NAMESPACE_OID,
+                                    "{}-{}".format(read_id, copy_num)))
+            read.attrs['read_id'] = np.bytes_(new_id)
+
+
+def replay(timestamps: np.ndarray, scale: float,
+           deposit: Callable[[int], None], clock=None,
+           progress: Callable[[int], None] = None) -> np.ndarray:
+    """Deposits each read at its scheduled time. Each read is scheduled
+    relative to the start of the replay rather than the previous read, so
+    time spent depositing does not accumulate into drift.
+
+    :param timestamps: sorted times the reads are due.
+    :param scale: amount to speed the replay up by.
+    :param deposit: function called with the position in timestamps of each
+    read when it is due.
+    :param clock: clock to schedule against. Defaults to a SystemClock.
+    :param progress: function called with the position in timestamps of each
+    read after it is deposited.
+    :return: seconds after the start of the replay each read was deposited.
+    """
+    if clock is None:
+        clock = SystemClock()
+
+    offsets = schedule_offsets(timestamps, scale)
+    deposit_times = np.empty_like(offsets)
+    start = clock.now()
+
+    # index the array per read rather than converting it to a list, which
+    # would hold a python float for every read of the run
+    for i in range(len(offsets)):
+        wait = start + float(offsets[i]) - clock.now()
+        if wait > 0:
+            with profiling.stage('wait'):
+                clock.sleep(wait)
+
+        deposit_times[i] = clock.now() - start
+        deposit(i)
+
+        if progress is not None:
+            progress(i)
+
+    return deposit_times
+
+
+def read_sizes(index_: Index) -> np.ndarray:
+    """Gets the size in bytes of each read's file. Sizes are recorded in the
+    index when it is built, but indexes written by older versions lack them,
+    so each file is looked up instead. Files that cannot be found are given a
+    size of 0.
+
+    :param index_: index to get sizes for.
+    :return: size of each read in the index.
+    """
+    if index_.sizes is not None:
+        return index_.sizes
+
+    logging.warning(" The index does not record file sizes, looking up the "
+                    "size of each file. Rebuild the index to avoid this.")
+    sizes = np.fromiter((get_size_for_path(filepath)
+                         for filepath in index_.paths),
+                        dtype=np.int64, count=len(index_.paths))
+    num_missing = int(np.count_nonzero(sizes == 0))
+    if num_missing:
+        logging.warning(" Could not get the size of {} of {} files. They are "
+                        "counted as 0 bytes.".format(num_missing, len(sizes)))
+    return sizes
+
+
+def timeline_stats(deposit_times: np.ndarray, sizes: np.ndarray,
+                   num_gaps: int = 5) -> dict:
+    """Summarises when reads are deposited during a replay.
+
+    :param deposit_times: seconds after the start each read is deposited.
+    :param sizes: size in bytes of each read.
+    :param num_gaps: number of longest gaps to report.
+    :return: dictionary of the reads and bytes deposited each minute, the peak
+    number of reads deposited in one second, the longest gaps between reads
+    as (start, length) pairs, and the total duration in seconds.
+    """
+    if len(deposit_times) == 0:
+        return {'reads_per_minute': np.zeros(0, dtype=np.int64),
+                'bytes_per_minute': np.zeros(0, dtype=np.int64),
+                'peak_reads_per_second': 0, 'longest_gaps': [],
+                'duration': 0.0}
+
+    minutes = (deposit_times // 60).astype(np.int64)
+    # count only the seconds reads fall in, as a run can span months
+    _, reads_per_second = np.unique(deposit_times.astype(np.int64),
+                                    return_counts=True)
+
+    gaps = np.diff(deposit_times)
+    # indices of the longest gaps, longest first
+    longest = np.argsort(gaps, kind='mergesort')[::-1][:num_gaps]
+
+    return {
+        'reads_per_minute': np.bincount(minutes),
+        'bytes_per_minute': np.bincount(minutes,
+                                        weights=sizes).astype(np.int64),
+        'peak_reads_per_second': int(reads_per_second.max()),
+        'longest_gaps': [(float(deposit_times[i]), float(gaps[i]))
+                         for i in longest],
+        'duration': float(deposit_times[-1])
+    }
+
+
+def format_timeline(stats: dict, csv: bool = False) -> str:
+    """Formats timeline statistics as a summary, or as a per-minute CSV
+    table.
+
+    :param stats: statistics from timeline_stats.
+    :param csv: output the per-minute table, as CSV, instead of the summary.
+    :return: the formatted report.
+    """
+    reads_per_minute = stats['reads_per_minute']
+    if csv:
+        lines = ["minute,reads,bytes"]
+        lines += ["{},{},{}".format(minute, reads, num_bytes)
+                  for minute, (reads, num_bytes) in enumerate(
+                      zip(reads_per_minute.tolist(),
+                          stats['bytes_per_minute'].tolist()))]
+        return "\n".join(lines)
+
+    mb_per_minute = stats['bytes_per_minute'] / 1e6
+    lines = [
+        "Total duration: {:.2f} minutes".format(stats['duration'] / 60),
+        "Total reads: {}".format(int(reads_per_minute.sum())),
+        "Total size: {:.2f} MB".format(float(mb_per_minute.sum()))
+    ]
+    if len(reads_per_minute) > 0:
+        lines += [
+            "Reads per minute: mean {:.1f}, max {}".format(
+                reads_per_minute.mean(), reads_per_minute.max()),
+            "MB per minute: mean {:.2f}, max {:.2f}".format(
+                mb_per_minute.mean(), mb_per_minute.max())
+        ]
+    lines.append("Peak burst rate: {} reads/second".format(
+        stats['peak_reads_per_second']))
+    lines.append("Longest gaps:")
+    lines += ["  {:.3f} seconds starting at {:.3f} seconds".format(
+        length, start) for start, length in stats['longest_gaps']]
+    return "\n".join(lines)
+
+
+def dry_run(args, index_: Index):
+    """Runs the replay schedule on a virtual clock, without waiting or copying,
+    and reports the deposit timeline."""
+    schedule = amplify_schedule(index_.timestamps, args.amplify,
+                                args.amplify_jitter, args.seed)
+    logging.info(" Dry run of {} files at scale {}".format(
+        len(schedule.timestamps), args.scale))
+
+    deposit_times = replay(schedule.timestamps, args.scale,
+                           deposit=lambda i: None, clock=VirtualClock())
+    sizes = read_sizes(index_)[schedule.sources]
+    stats = timeline_stats(deposit_times, sizes)
+    print(format_timeline(stats))
+
+    if args.timeline_csv:
+        with open(args.timeline_csv, 'w') as csv_file:
+            csv_file.write(format_timeline(stats, csv=True) + "\n")
+        logging.info(" Per-minute timeline saved as: {}".format(
+            args.timeline_csv))
+
+
+def simulate_read_generation(args, index_: Index):
     """Handles the copy from input to output and the delays in between."""
-    logging.info(" Starting transfer of {} files to {}".format(len(index_list),
-                                                               args.output))
+    if index_.root is not None and \
+            index_.root != input_root(args.input_dir):
+        logging.error(" The index was built from {}, not {}. "
+                      "Exiting...".format(index_.root, args.input_dir))
+        return
 
-    duration_secs = sum(delay for (delay, _) in index_list) / args.scale
-    duration_mins = round(duration_secs / 60, 2)
+    from_archive = index_.offsets is not None
+    schedule = amplify_schedule(index_.timestamps, args.amplify,
+                                args.amplify_jitter, args.seed)
+    num_reads = len(schedule.timestamps)
+    if num_reads == 0:
+        logging.error(" Empty index. Exiting...")
+        return
 
-    logging.info(" Simulation will take {} minutes".format(duration_mins))
+    logging.info(" Starting transfer of {} files to {}".format(num_reads,
+                                                               args.output))
 
-    # todo: add progress bar
-    for i, (delay, filepath) in enumerate(index_list):
-        output_filepath = generate_output_filepath(filepath, args.output,
-                                                   args.input_dir)
-        # wait between copy
-        time.sleep(delay / args.scale)
+    offsets = schedule_offsets(schedule.timestamps, args.scale)
+    duration_mins = round(float(offsets[-1]) / 60, 2)
 
-        read_deposit(filepath, output_filepath)
+    logging.info(" Simulation will take {} minutes".format(duration_mins))
 
-        if not args.no_progress_bar:
-            update_progress(round(i / len(index_list), 4))
+    paths = index_.paths
+
+    def warm(i: int):
+        warm_read(index_, int(schedule.sources[i]),
+                  archive_path=args.input_dir)
+
+    # the look ahead is given in replay seconds, the index is in run seconds
+    prefetcher = Prefetcher(schedule.timestamps, warm,
+                            max_reads=args.prefetch_reads,
+                            max_secs=args.prefetch_secs * args.scale)
+
+    with ExitStack() as stack:
+        stack.enter_context(prefetcher)
+        if from_archive:
+            archive = stack.enter_context(open(args.input_dir, 'rb'))
+
+        def deposit(i: int):
+            source = int(schedule.sources[i])
+            copy_num = int(schedule.copies[i])
+            filepath = paths[source]
+            with profiling.stage('output_path'):
+                if from_archive:  # member names are relative to the archive
+                    output_filepath = pathlib.Path(args.output, filepath)
+                else:
+                    output_filepath = generate_output_filepath(
+                        filepath, args.output, args.input_dir)
+                output_filepath = amplified_filepath(output_filepath,
+                                                     copy_num)
+
+            # extra copies are written under a temporary name and only moved
+            # into place once they have a new read ID, so a consumer never
+            # sees a duplicate ID or a partial file. only a real hardlink,
+            # which shares its content with the original read, keeps its ID.
+            if copy_num > 0:
+                deposit_filepath = temporary_filepath(output_filepath)
+            else:
+                deposit_filepath = output_filepath
+
+            hardlinked = False
+            with profiling.stage('copy'):
+                if from_archive:
+                    archive_member_deposit(archive,
+                                           int(index_.offsets[source]),
+                                           int(index_.sizes[source]),
+                                           deposit_filepath)
+                elif copy_num == 0:
+                    read_deposit(filepath, deposit_filepath)
+                else:
+                    hardlinked = link_deposit(filepath, deposit_filepath,
+                                              args.amplify_method)
+
+            if copy_num > 0:
+                try:
+                    if not hardlinked:
+                        with profiling.stage('rewrite_read_id'):
+                            rewrite_read_id(deposit_filepath, copy_num)
+                    os.replace(deposit_filepath, output_filepath)
+                except OSError as err:
+                    logging.warning(" Could not rewrite read ID of {}: {} "
+                                    "Skipping...".format(output_filepath,
+                                                         err))
+                    deposit_filepath.unlink()
+            # start warming for the next read while waiting for it
+            prefetcher.advance(i + 1)
+
+        def progress(i: int):
+            update_progress(round(i / num_reads, 4))
+
+        replay(schedule.timestamps, args.scale, deposit,
+               progress=None if args.no_progress_bar else progress)
 
     if not args.no_progress_bar:
         update_progress(1.0)
@@ -299,10 +1463,26 @@ def simulate_read_generation(args, index_list):
 
 def main(args):
     """Runs the indexing of the files and copying to destination."""
-    index_list = index(args)
+    # check before indexing, which can take hours for a large archive
+    if args.output and not args.dry_run and os.path.isfile(args.input_dir) \
+            and is_compressed_archive(args.input_dir):
+        logging.error(" Depositing reads from a compressed archive is not "
+                      "supported. Decompress the archive first. An index "
+                      "of the compressed archive remains valid for the "
+                      "decompressed archive. Exiting...")
+        return
+
+    index_ = index(args)
+
+    if index_ is None:  # indexing failed
+        return
+
+    if args.dry_run:
+        dry_run(args, index_)
+        return
 
     # if no output directory was given, stop here.
     if not args.output:
         return
 
-    simulate_read_generation(args, index_list)
+    simulate_read_generation(args, index_)
@@ -0,0 +1,74 @@
+"""Tests for `taeper.profiling` module."""
+import unittest
+import os
+import tempfile
+from taeper import profiling
+
+
+class TestStageStats(unittest.TestCase):
+    """Test the running statistics of a stage"""
+
+    def test_GeneralCase_TotalsAndMean(self):
+        stats = profiling.StageStats()
+        for secs in (0.001, 0.002, 0.003):
+            stats.add(secs)
+        self.assertEqual(stats.calls, 3)
+        self.assertAlmostEqual(stats.total, 0.006)
+        self.assertAlmostEqual(stats.mean, 0.002)
+        self.assertEqual(stats.max, 0.003)
+
+    def test_Percentile_WithinBucketResolution(self):
+        stats = profiling.StageStats()
+        for _ in range(99):
+            stats.add(0.001)
+        stats.add(1.0)
+        result = stats.percentile(99)
+        self.assertGreaterEqual(result, 0.001)
+        self.assertLess(result, 0.0013)
+        self.assertEqual(stats.percentile(100), 1.0)
+
+    def test_NoCalls_Zero(self):
+        stats = profiling.StageStats()
+        self.assertEqual(stats.mean, 0.0)
+        self.assertEqual(stats.percentile(99), 0.0)
+
+
+class TestStageProfiler(unittest.TestCase):
+    """Test the stage profiler"""
+
+    def test_Disabled_NothingRecorded(self):
+        profiler = profiling.StageProfiler()
+        with profiler.stage('copy'):
+            pass
+        self.assertDictEqual(profiler.stats, {})
+
+    def test_Enabled_CallsRecordedPerStage(self):
+        profiler = profiling.StageProfiler()
+        profiler.enable()
+        for _ in range(3):
+            with profiler.stage('copy'):
+                pass
+        with profiler.stage('sort'):
+            pass
+        self.assertEqual(profiler.stats['copy'].calls, 3)
+        self.assertEqual(profiler.stats['sort'].calls, 1)
+
+    def test_Report_OneLinePerStagePlusHeader(self):
+        profiler = profiling.StageProfiler()
+        profiler.record('copy', 0.5)
+        profiler.record('sort', 1.5)
+        result = profiler.report().splitlines()
+        self.assertEqual(len(result), 3)
+        self.assertTrue(result[1].startswith('sort'))
+
+    def test_CprofileDir_StatsDumpedForOutermostStage(self):
+        profiler = profiling.StageProfiler()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler.enable(cprofile_dir=tmpdir)
+            with profiler.stage('outer'):
+                with profiler.stage('inner'):
+                    pass
+            result = [os.path.basename(path)
+                      for path in profiler.dump_cprofiles()]
+        self.assertListEqual(result, ['outer.pstats'])
+        self.assertEqual(profiler.stats['inner'].calls, 1)
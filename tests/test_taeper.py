@@ -1,11 +1,22 @@
 """Tests for `taeper` package."""
 import unittest
+import argparse
+import contextlib
+import io
 import pathlib
 import logging
+import os
+import tarfile
+import shutil
+import tempfile
+import threading
+import numpy as np
 from taeper import taeper
 
 logging.disable(logging.CRITICAL)
 
+TEST_READ = 'tests/data/pass/read9.fast5'
+
 
 class TestZuluToEpochTime(unittest.TestCase):
     """Test Zulu to Epoch converter function."""
@@ -92,60 +103,120 @@ class TestScantree(unittest.TestCase):
             self.assertEqual(x, y)
 
 
-class TestFilterList(unittest.TestCase):
-    """Test filter list function"""
+EXPECTED_DELAYS = [0.0, 24839288.405, 7.476, 1.327, 6.065, 18.221, 34.035,
+                   3.294, 0.126, 8.73, 0.235]
+EXPECTED_PATHS = [
+    'tests/data/pass/random.fast5',
+    'tests/data/pass/read7.fast5',
+    'tests/data/pass/read9.fast5',
+    'tests/data/pass/read8.fast5',
+    'tests/data/pass/read3.fast5',
+    'tests/data/pass/read2.fast5',
+    'tests/data/fail/read6.fast5',
+    'tests/data/pass/read1.fast5',
+    'tests/data/pass/read5.fast5',
+    'tests/data/fail/read0.fast5',
+    'tests/data/pass/read4.fast5'
+]
+
+
+class TestPathStore(unittest.TestCase):
+    """Test the compact path store"""
+
+    def setUp(self):
+        self.paths = ['runs/b/pass/read1.fast5', 'runs/a/fail/read2.fast5',
+                      'runs/b/pass/read3.fast5', 'read4.fast5']
+
+    def test_FromPaths_SamePathsOut(self):
+        result = taeper.PathStore.from_paths(self.paths)
+        self.assertEqual(len(result), 4)
+        self.assertListEqual(result.tolist(), self.paths)
+        self.assertEqual(result[1], 'runs/a/fail/read2.fast5')
+
+    def test_FromPaths_DistinctDirectoriesStoredOnce(self):
+        result = taeper.PathStore.from_paths(self.paths)
+        expected = ['', 'runs/a/fail', 'runs/b/pass']
+        self.assertListEqual(result.directories.tolist(), expected)
+
+    def test_NonAsciiPath_SamePathOut(self):
+        paths = ['données/lecture.fast5']
+        result = taeper.PathStore.from_paths(paths)
+        self.assertListEqual(result.tolist(), paths)
+
+    def test_SelectWithMask_SubsetOfPaths(self):
+        store = taeper.PathStore.from_paths(self.paths)
+        result = store[np.array([True, False, False, True])]
+        expected = ['runs/b/pass/read1.fast5', 'read4.fast5']
+        self.assertListEqual(result.tolist(), expected)
+
+    def test_Concatenate_PathsOfEachStoreInTurn(self):
+        first = taeper.PathStore.from_paths(self.paths[:2])
+        second = taeper.PathStore.from_paths(self.paths[2:])
+        result = taeper.PathStore.concatenate([first, second])
+        self.assertListEqual(result.tolist(), self.paths)
+        self.assertEqual(len(result.directories), 3)
+
+
+class TestBuildIndex(unittest.TestCase):
+    """Test build index function"""
+
+    def test_UnsortedTimestamps_SortedByTimestamp(self):
+        timestamps = [7.0, 4.0, 10.0]
+        paths = ['b', 'a', 'c']
+        result = taeper.build_index(timestamps, paths)
+        self.assertListEqual(result.timestamps.tolist(), [4.0, 7.0, 10.0])
+        self.assertListEqual(result.paths.tolist(), ['a', 'b', 'c'])
+
+    def test_ZeroTimestamps_FilteredOut(self):
+        timestamps = [7.0, 0.0, 4.0, 0.0]
+        paths = ['b', 'x', 'a', 'y']
+        result = taeper.build_index(timestamps, paths)
+        self.assertListEqual(result.timestamps.tolist(), [4.0, 7.0])
+        self.assertListEqual(result.paths.tolist(), ['a', 'b'])
+
+    def test_TiedTimestamps_SortedByPath(self):
+        timestamps = [4.0, 4.0]
+        paths = ['b', 'a']
+        result = taeper.build_index(timestamps, paths)
+        self.assertListEqual(result.paths.tolist(), ['a', 'b'])
+
+    def test_EmptyInput_EmptyIndex(self):
+        result = taeper.build_index([], [])
+        self.assertEqual(len(result.timestamps), 0)
+        self.assertEqual(len(result.paths), 0)
+
+
+class TestComputeDelays(unittest.TestCase):
+    """Test compute delays function"""
 
-    def test_ListWithNoNoneOrEmptyList_NoChange(self):
-        xs = [1, 2, 3]
-        result = taeper.filter_list(xs)
-        expected = [1, 2, 3]
-        self.assertListEqual(result, expected)
+    def test_GeneralCase(self):
+        timestamps = np.array([4.0, 7.0, 10.0])
+        result = taeper.compute_delays(timestamps)
+        expected = [0.0, 3.0, 3.0]
+        self.assertListEqual(result.tolist(), expected)
 
-    def test_ListWithNoneButNoEmptyList_FilterOutNone(self):
-        xs = [1, 2, None, 3]
-        result = taeper.filter_list(xs)
-        expected = [1, 2, 3]
-        self.assertListEqual(result, expected)
+    def test_EmptyArray_EmptyArray(self):
+        result = taeper.compute_delays(np.array([]))
+        self.assertListEqual(result.tolist(), [])
 
-    def test_ListWithNoNoneButEmptyList_FilterOutEmptyList(self):
-        xs = [1, 2, [], 3]
-        result = taeper.filter_list(xs)
-        expected = [1, 2, 3]
-        self.assertListEqual(result, expected)
 
-    def test_ListWithNoneAndEmptyList_FilterOutEmptyListAndNone(self):
-        xs = [1, None, 2, [], 3]
-        result = taeper.filter_list(xs)
-        expected = [1, 2, 3]
-        self.assertListEqual(result, expected)
+class TestScheduleOffsets(unittest.TestCase):
+    """Test the calculation of when each read is due"""
 
-    def test_EmptyList_ReturnEmptyList(self):
-        xs = []
-        result = taeper.filter_list(xs)
-        expected = []
-        self.assertListEqual(result, expected)
+    def test_Scale_OffsetsFromFirstReadScaled(self):
+        timestamps = np.array([100.0, 103.0, 110.0])
+        result = taeper.schedule_offsets(timestamps, 2.0)
+        expected = [0.0, 1.5, 5.0]
+        self.assertListEqual(result.tolist(), expected)
 
-    def test_ListWithOnlyNone_ReturnEmptyList(self):
-        xs = [None]
-        result = taeper.filter_list(xs)
-        expected = []
-        self.assertListEqual(result, expected)
-
-    def test_ListWithOnlyEmptyList_ReturnEmptyList(self):
-        xs = [[]]
-        result = taeper.filter_list(xs)
-        expected = []
-        self.assertListEqual(result, expected)
+    def test_ManySubMillisecondDelays_NoDrift(self):
+        timestamps = 1e9 + np.arange(100000) * 0.0004
+        result = taeper.schedule_offsets(timestamps, 1.0)
+        self.assertAlmostEqual(result[-1], 99999 * 0.0004, places=3)
 
-
-class TestCentreList(unittest.TestCase):
-    """Test centre list function"""
-
-    def test_GeneralCase(self):
-        xs = [[4, 'a'], [7, 'b'], [10, 'c']]
-        result = taeper.centre_list(xs)
-        expected = [(0, 'a'), (3, 'b'), (3, 'c')]
-        self.assertListEqual(result, expected)
+    def test_EmptyArray_EmptyArray(self):
+        result = taeper.schedule_offsets(np.array([]), 1.0)
+        self.assertListEqual(result.tolist(), [])
 
 
 class TestGenerateIndex(unittest.TestCase):
@@ -154,42 +225,143 @@ class TestGenerateIndex(unittest.TestCase):
     def test_TestFast5Files(self):
         test_dir = 'tests/data'
         result = taeper.generate_index(test_dir)
-        expected = [
-            (0.0, 'tests/data/pass/random.fast5'),
-            (24839288.405, 'tests/data/pass/read7.fast5'),
-            (7.476, 'tests/data/pass/read9.fast5'),
-            (1.327, 'tests/data/pass/read8.fast5'),
-            (6.065, 'tests/data/pass/read3.fast5'),
-            (18.221, 'tests/data/pass/read2.fast5'),
-            (34.035, 'tests/data/fail/read6.fast5'),
-            (3.294, 'tests/data/pass/read1.fast5'),
-            (0.126, 'tests/data/pass/read5.fast5'),
-            (8.73, 'tests/data/fail/read0.fast5'),
-            (0.235, 'tests/data/pass/read4.fast5')
-        ]
-        self.assertListEqual(result, expected)
+        delays = taeper.compute_delays(result.timestamps)
+        self.assertListEqual(delays.tolist(), EXPECTED_DELAYS)
+        self.assertListEqual(result.paths.tolist(), EXPECTED_PATHS)
+
+    def test_TestFast5Files_SizesRecorded(self):
+        result = taeper.generate_index('tests/data')
+        expected = [os.path.getsize(path) for path in EXPECTED_PATHS]
+        self.assertListEqual(result.sizes.tolist(), expected)
+        self.assertIsNone(result.offsets)
+
+
+class TestReadSizes(unittest.TestCase):
+    """Test getting the size of each read for the dry run"""
+
+    def test_SizesInIndex_Used(self):
+        index_ = taeper.build_index([1.0, 2.0], ['a', 'b'], sizes=[10, 20])
+        result = taeper.read_sizes(index_)
+        self.assertListEqual(result.tolist(), [10, 20])
+
+    def test_NoSizesInIndex_LookedUpMissingAsZero(self):
+        index_ = taeper.build_index([1.0, 2.0],
+                                    [TEST_READ, 'tests/data/missing.fast5'])
+        result = taeper.read_sizes(index_)
+        self.assertListEqual(result.tolist(),
+                             [os.path.getsize(TEST_READ), 0])
+
+
+class TestInShard(unittest.TestCase):
+    """Test the assignment of files to shards"""
+
+    def test_EachFileInExactlyOneShard(self):
+        num_shards = 3
+        for filepath in EXPECTED_PATHS:
+            shards = [shard_num for shard_num in range(num_shards)
+                      if taeper.in_shard(filepath, 'tests/data',
+                                         (shard_num, num_shards))]
+            self.assertEqual(len(shards), 1)
+
+    def test_SameRelativePathDifferentInputDir_SameShard(self):
+        shard = (0, 4)
+        result = taeper.in_shard('/a/pass/read1.fast5', '/a', shard)
+        expected = taeper.in_shard('/b/c/pass/read1.fast5', '/b/c', shard)
+        self.assertEqual(result, expected)
+
+
+class TestMergeIndexes(unittest.TestCase):
+    """Test the merging of partial indexes"""
+
+    def test_MergeShards_SameAsFullIndex(self):
+        test_dir = 'tests/data'
+        num_shards = 3
+        shards = [taeper.generate_index(test_dir, shard=(i, num_shards))
+                  for i in range(num_shards)]
+        result = taeper.merge_indexes(shards)
+        delays = taeper.compute_delays(result.timestamps)
+        self.assertListEqual(delays.tolist(), EXPECTED_DELAYS)
+        self.assertListEqual(result.paths.tolist(), EXPECTED_PATHS)
+
+    def test_InterleavedIndexes_SortedByTimestamp(self):
+        first = taeper.build_index([1.0, 5.0], ['a', 'c'], root='run')
+        second = taeper.build_index([3.0, 7.0], ['b', 'd'], root='run')
+        result = taeper.merge_indexes([first, second])
+        self.assertListEqual(result.timestamps.tolist(), [1.0, 3.0, 5.0, 7.0])
+        self.assertListEqual(result.paths.tolist(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(result.root, 'run')
+
+    def test_DifferentRoots_Error(self):
+        first = taeper.build_index([1.0], ['a/r.fast5'], root='a')
+        second = taeper.build_index([2.0], ['b/r.fast5'], root='b')
+        with self.assertRaises(ValueError):
+            taeper.merge_indexes([first, second])
+
+    def test_LegacyIndex_Error(self):
+        legacy = taeper.load_index('tests/data/taeper_index.npy')
+        shard = taeper.generate_index('tests/data', shard=(0, 2))
+        with self.assertRaises(ValueError):
+            taeper.merge_indexes([legacy, shard])
+
+    def test_NoIndexes_EmptyIndex(self):
+        result = taeper.merge_indexes([])
+        self.assertEqual(len(result.timestamps), 0)
+
+    def test_MissingOrCorruptIndex_NothingSaved(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shard_path = os.path.join(tmpdir, 'shard.npy')
+            taeper.save_index(shard_path,
+                              taeper.generate_index('tests/data'))
+            corrupt_path = os.path.join(tmpdir, 'corrupt.npy')
+            with open(shard_path, 'rb') as shard, \
+                    open(corrupt_path, 'wb') as corrupt:
+                corrupt.write(shard.read(200))
+            dump_index = os.path.join(tmpdir, 'merged.npy')
+            for bad_path in (os.path.join(tmpdir, 'missing.npy'),
+                             corrupt_path):
+                args = argparse.Namespace(indexes=[shard_path, bad_path],
+                                          dump_index=dump_index)
+                taeper.merge(args)
+                self.assertFalse(os.path.exists(dump_index))
 
 
 class TestLoadIndex(unittest.TestCase):
     """Test the loading of an index file"""
 
-    def test_LoadIndex_SameAsGeneratedIndex(self):
+    def test_LoadLegacyIndex_SameAsGeneratedIndex(self):
         test_index = 'tests/data/taeper_index.npy'
         result = taeper.load_index(test_index)
-        expected = [
-            (0.0, 'tests/data/pass/random.fast5'),
-            (24839288.405, 'tests/data/pass/read7.fast5'),
-            (7.476, 'tests/data/pass/read9.fast5'),
-            (1.327, 'tests/data/pass/read8.fast5'),
-            (6.065, 'tests/data/pass/read3.fast5'),
-            (18.221, 'tests/data/pass/read2.fast5'),
-            (34.035, 'tests/data/fail/read6.fast5'),
-            (3.294, 'tests/data/pass/read1.fast5'),
-            (0.126, 'tests/data/pass/read5.fast5'),
-            (8.73, 'tests/data/fail/read0.fast5'),
-            (0.235, 'tests/data/pass/read4.fast5')
-        ]
-        self.assertListEqual(result, expected)
+        delays = taeper.compute_delays(result.timestamps)
+        self.assertListEqual(delays.tolist(), EXPECTED_DELAYS)
+        self.assertListEqual(result.paths.tolist(), EXPECTED_PATHS)
+
+    def test_SaveThenLoad_SameIndex(self):
+        index_ = taeper.build_index([4.5, 7.25, 10.0], ['a', 'bb', 'ccc'],
+                                    root='run')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_path = os.path.join(tmpdir, 'index.npy')
+            taeper.save_index(index_path, index_)
+            result = taeper.load_index(index_path)
+        self.assertListEqual(result.timestamps.tolist(), [4.5, 7.25, 10.0])
+        self.assertListEqual(result.paths.tolist(), ['a', 'bb', 'ccc'])
+        self.assertIsNone(result.offsets)
+        self.assertIsNone(result.sizes)
+        self.assertEqual(result.root, 'run')
+
+    def test_LoadLegacyIndex_NoRoot(self):
+        result = taeper.load_index('tests/data/taeper_index.npy')
+        self.assertIsNone(result.root)
+
+    def test_SaveThenLoadArchiveIndex_SameIndex(self):
+        index_ = taeper.build_index([4.5, 7.25], ['a', 'b'], [512, 2048],
+                                    [100, 200])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_path = os.path.join(tmpdir, 'index.npy')
+            taeper.save_index(index_path, index_)
+            result = taeper.load_index(index_path)
+        self.assertListEqual(result.paths.tolist(), ['a', 'b'])
+        self.assertListEqual(result.offsets.tolist(), [512, 2048])
+        self.assertListEqual(result.sizes.tolist(), [100, 200])
 
 
 class TestGenerateOutputFilepath(unittest.TestCase):
@@ -212,3 +384,512 @@ class TestGenerateOutputFilepath(unittest.TestCase):
                                                  input_dir)
         expected = pathlib.Path('tests/data/tmp/pass/read.fast5')
         self.assertEqual(result, expected)
+
+
+class TestPrefetchWindowEnd(unittest.TestCase):
+    """Test the calculation of the prefetch window"""
+
+    def setUp(self):
+        self.timestamps = np.array([0.0, 1.0, 2.0, 10.0, 11.0])
+
+    def test_ReadsOnly_WindowOfMaxReads(self):
+        result = taeper.prefetch_window_end(self.timestamps, 1, 2, 0)
+        expected = 3
+        self.assertEqual(result, expected)
+
+    def test_SecsOnly_WindowUpToTime(self):
+        result = taeper.prefetch_window_end(self.timestamps, 0, 0, 2.0)
+        expected = 3
+        self.assertEqual(result, expected)
+
+    def test_ReadsAndSecs_FurthestWindow(self):
+        result = taeper.prefetch_window_end(self.timestamps, 0, 4, 2.0)
+        expected = 4
+        self.assertEqual(result, expected)
+
+    def test_PositionPastEnd_EmptyWindow(self):
+        result = taeper.prefetch_window_end(self.timestamps, 5, 2, 1.0)
+        expected = 5
+        self.assertEqual(result, expected)
+
+    def test_WindowPastEnd_CappedAtLength(self):
+        result = taeper.prefetch_window_end(self.timestamps, 3, 10, 100.0)
+        expected = 5
+        self.assertEqual(result, expected)
+
+
+class TestPrefetcher(unittest.TestCase):
+    """Test the background prefetching of files"""
+
+    def test_AdvanceThroughIndex_WarmsWindowInOrder(self):
+        index_ = taeper.build_index([1.0, 2.0, 3.0, 4.0], list('abcd'))
+        warmed = []
+        window_warmed = threading.Semaphore(0)
+
+        def warm(position):
+            warmed.append(index_.paths[position])
+            if len(warmed) % 2 == 0:
+                window_warmed.release()
+
+        with taeper.Prefetcher(index_.timestamps, warm,
+                               max_reads=2) as prefetcher:
+            self.assertTrue(window_warmed.acquire(timeout=5))
+            self.assertListEqual(warmed, list('ab'))
+            prefetcher.advance(2)
+            self.assertTrue(window_warmed.acquire(timeout=5))
+        self.assertListEqual(warmed, list('abcd'))
+
+    def test_Disabled_NothingWarmed(self):
+        index_ = taeper.build_index([1.0, 2.0], list('ab'))
+        warmed = []
+        with taeper.Prefetcher(index_.timestamps,
+                               warmed.append) as prefetcher:
+            prefetcher.advance(1)
+        self.assertListEqual(warmed, [])
+
+    def test_WarmMissingFile_NoError(self):
+        taeper.warm_file('tests/data/does_not_exist.fast5')
+
+    def test_WarmFileRegion_NoError(self):
+        taeper.warm_file('tests/data/pass/read9.fast5', 512, 1024)
+
+
+class TestArchive(unittest.TestCase):
+    """Test indexing and depositing reads from tar archives"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive_path = os.path.join(self.tmpdir.name, 'run.tar')
+        with tarfile.open(self.archive_path, 'w') as tar:
+            tar.add('tests/data', arcname='data')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def expected_paths(self):
+        return [path.replace('tests/', '', 1) for path in EXPECTED_PATHS]
+
+    def test_GenerateIndexFromTar_SameAsDirectoryIndex(self):
+        result = taeper.generate_index(self.archive_path)
+        delays = taeper.compute_delays(result.timestamps)
+        self.assertListEqual(delays.tolist(), EXPECTED_DELAYS)
+        self.assertListEqual(result.paths.tolist(), self.expected_paths())
+
+    def test_GenerateIndexFromGzipTar_SameOffsetsAsTar(self):
+        gzip_path = self.archive_path + '.gz'
+        with tarfile.open(gzip_path, 'w:gz') as tar:
+            tar.add('tests/data', arcname='data')
+        result = taeper.generate_index(gzip_path)
+        expected = taeper.generate_index(self.archive_path)
+        delays = taeper.compute_delays(result.timestamps)
+        self.assertListEqual(delays.tolist(), EXPECTED_DELAYS)
+        self.assertListEqual(result.offsets.tolist(),
+                             expected.offsets.tolist())
+        self.assertTrue(taeper.is_compressed_archive(gzip_path))
+        self.assertFalse(taeper.is_compressed_archive(self.archive_path))
+
+    def test_ArchiveMemberDeposit_SameAsOriginalFile(self):
+        index_ = taeper.generate_index(self.archive_path)
+        position = index_.paths.tolist().index('data/pass/read9.fast5')
+        output_filepath = pathlib.Path(self.tmpdir.name, 'out', 'read9.fast5')
+        with open(self.archive_path, 'rb') as archive:
+            taeper.archive_member_deposit(archive,
+                                          int(index_.offsets[position]),
+                                          int(index_.sizes[position]),
+                                          output_filepath)
+        with open('tests/data/pass/read9.fast5', 'rb') as original:
+            expected = original.read()
+        self.assertEqual(output_filepath.read_bytes(), expected)
+
+    def test_UnsafeMemberNames_Skipped(self):
+        unsafe_path = os.path.join(self.tmpdir.name, 'unsafe.tar')
+        read = 'tests/data/pass/read9.fast5'
+        with tarfile.open(unsafe_path, 'w') as tar:
+            # add strips leading slashes, so build the members by hand
+            for name in ('pass/read9.fast5', 'pass/../../../escaped.fast5',
+                         '/abs/read9.fast5'):
+                member = tar.gettarinfo(read)
+                member.name = name
+                with open(read, 'rb') as fileobj:
+                    tar.addfile(member, fileobj)
+        result = taeper.generate_index(unsafe_path)
+        expected = ['pass/read9.fast5']
+        self.assertListEqual(result.paths.tolist(), expected)
+
+    def test_IndexGzipTarReplayFromTar_ReadsDeposited(self):
+        gzip_path = self.archive_path + '.gz'
+        with tarfile.open(gzip_path, 'w:gz') as tar:
+            tar.add('tests/data', arcname='data')
+        index_ = taeper.generate_index(gzip_path)
+        self.assertEqual(index_.root, self.archive_path)
+        output = os.path.join(self.tmpdir.name, 'out')
+        args = argparse.Namespace(
+            input_dir=self.archive_path, output=output, scale=1e12,
+            amplify=1, amplify_jitter=0.0, amplify_method='reflink',
+            seed=None, prefetch_reads=0, prefetch_secs=0.0,
+            no_progress_bar=True)
+        taeper.simulate_read_generation(args, index_)
+        with open(TEST_READ, 'rb') as original:
+            expected = original.read()
+        result = pathlib.Path(output, 'data/pass/read9.fast5').read_bytes()
+        self.assertEqual(result, expected)
+        self.assertEqual(len(list(pathlib.Path(output).rglob('*.fast5'))),
+                         len(EXPECTED_PATHS))
+
+    def test_IndexFileThatIsNotArchive_NoIndex(self):
+        args = argparse.Namespace(index=None, input_dir=TEST_READ,
+                                  shard=None)
+        self.assertIsNone(taeper.index(args))
+
+    def test_DepositFromCompressedArchive_StopsBeforeIndexing(self):
+        gzip_path = self.archive_path + '.gz'
+        with tarfile.open(gzip_path, 'w:gz') as tar:
+            tar.add('tests/data', arcname='data')
+        dump_index = os.path.join(self.tmpdir.name, 'index.npy')
+        args = argparse.Namespace(
+            index=None, input_dir=gzip_path, shard=None, dry_run=False,
+            no_index=False, dump_index=dump_index,
+            output=os.path.join(self.tmpdir.name, 'out'))
+        taeper.main(args)
+        self.assertFalse(os.path.exists(dump_index))
+        self.assertFalse(os.path.exists(args.output))
+
+    def test_MergeArchiveAndDirectoryIndexes_Error(self):
+        archive_index = taeper.build_index([1.0], ['a'], [512], [10],
+                                           root='run')
+        directory_index = taeper.build_index([2.0], ['b'], root='run')
+        with self.assertRaises(ValueError):
+            taeper.merge_indexes([archive_index, directory_index])
+
+
+class TestVirtualClock(unittest.TestCase):
+    """Test the virtual clock"""
+
+    def test_Sleep_AdvancesTime(self):
+        clock = taeper.VirtualClock(start=10.0)
+        clock.sleep(2.5)
+        self.assertEqual(clock.now(), 12.5)
+
+    def test_NegativeSleep_TimeUnchanged(self):
+        clock = taeper.VirtualClock()
+        clock.sleep(-1.0)
+        self.assertEqual(clock.now(), 0.0)
+
+
+class TestReplay(unittest.TestCase):
+    """Test the replay scheduler on a virtual clock"""
+
+    def setUp(self):
+        self.index = taeper.build_index([100.0, 103.0, 103.5, 110.0],
+                                        list('abcd'))
+
+    def test_VirtualClock_DepositedInOrderAtScheduledTimes(self):
+        deposited = []
+        clock = taeper.VirtualClock()
+
+        def deposit(i):
+            deposited.append((clock.now(), self.index.paths[i]))
+
+        result = taeper.replay(self.index.timestamps, 1.0, deposit,
+                               clock=clock)
+        expected = [0.0, 3.0, 3.5, 10.0]
+        self.assertListEqual(result.tolist(), expected)
+        self.assertListEqual(deposited, list(zip(expected, 'abcd')))
+
+    def test_Scale_TimesScaledDown(self):
+        result = taeper.replay(self.index.timestamps, 2.0, lambda i: None,
+                               clock=taeper.VirtualClock())
+        expected = [0.0, 1.5, 1.75, 5.0]
+        self.assertListEqual(result.tolist(), expected)
+
+    def test_SlowDeposit_NoDrift(self):
+        clock = taeper.VirtualClock()
+
+        def deposit(i):
+            clock.sleep(1.0)
+
+        result = taeper.replay(self.index.timestamps, 1.0, deposit,
+                               clock=clock)
+        expected = [0.0, 3.0, 4.0, 10.0]
+        self.assertListEqual(result.tolist(), expected)
+
+
+class TestTimelineStats(unittest.TestCase):
+    """Test the deposit timeline statistics"""
+
+    def test_GeneralCase(self):
+        deposit_times = np.array([0.0, 0.5, 0.9, 30.0, 130.0])
+        sizes = np.array([10, 20, 30, 40, 50])
+        result = taeper.timeline_stats(deposit_times, sizes, num_gaps=2)
+        self.assertListEqual(result['reads_per_minute'].tolist(), [4, 0, 1])
+        self.assertListEqual(result['bytes_per_minute'].tolist(),
+                             [100, 0, 50])
+        self.assertEqual(result['peak_reads_per_second'], 3)
+        self.assertListEqual(result['longest_gaps'],
+                             [(30.0, 100.0), (0.9, 29.1)])
+        self.assertEqual(result['duration'], 130.0)
+
+    def test_NoReads_EmptyTimeline(self):
+        result = taeper.timeline_stats(np.array([]), np.array([]))
+        self.assertEqual(len(result['reads_per_minute']), 0)
+        self.assertEqual(result['duration'], 0.0)
+
+
+class TestDryRun(unittest.TestCase):
+    """Test the dry run report"""
+
+    def setUp(self):
+        self.stats = taeper.timeline_stats(np.array([0.0, 0.5, 130.0]),
+                                           np.array([10, 20, 30]))
+
+    def test_FormatSummary_NoPerMinuteRows(self):
+        result = taeper.format_timeline(self.stats)
+        self.assertIn("Total reads: 3", result)
+        self.assertNotIn("minute,reads,bytes", result)
+
+    def test_FormatCsv_HeaderAndOneRowPerMinute(self):
+        result = taeper.format_timeline(self.stats, csv=True).splitlines()
+        expected = ['minute,reads,bytes', '0,2,30', '1,0,0', '2,1,30']
+        self.assertListEqual(result, expected)
+
+    def test_DryRun_SummaryPrintedTableWritten(self):
+        index_ = taeper.build_index([100.0, 103.0, 400.0], list('abc'),
+                                    sizes=[10, 20, 30])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, 'timeline.csv')
+            args = argparse.Namespace(amplify=1, amplify_jitter=0.0,
+                                      seed=None, scale=1.0,
+                                      timeline_csv=csv_path)
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                taeper.dry_run(args, index_)
+            with open(csv_path) as csv_file:
+                table = csv_file.read().splitlines()
+        self.assertIn("Total duration: 5.00 minutes", stdout.getvalue())
+        self.assertNotIn("minute,reads,bytes", stdout.getvalue())
+        self.assertListEqual(table, ['minute,reads,bytes', '0,2,30', '1,0,0',
+                                     '2,0,0', '3,0,0', '4,0,0', '5,1,30'])
+
+
+class TestReadClasses(unittest.TestCase):
+    """Test the classification of reads into pass and fail"""
+
+    def test_PassFailAndNeither_Classified(self):
+        paths = taeper.PathStore.from_paths([
+            'run/fail/read1.fast5', 'run/pass/barcode01/read2.fast5',
+            'run/read3.fast5', 'run/passed/read4.fast5'])
+        result = taeper.read_classes(paths)
+        expected = [2, 1, 0, 0]
+        self.assertListEqual(result.tolist(), expected)
+
+
+class TestRunProfile(unittest.TestCase):
+    """Test the run throughput profile"""
+
+    def setUp(self):
+        self.index = taeper.build_index(
+            [1000.0, 1010.0, 1030.0, 1125.0, 1200.0],
+            ['pass/a.fast5', 'fail/b.fast5', 'pass/c.fast5', 'pass/d.fast5',
+             'e.fast5'])
+
+    def test_GeneralCase_ReadsBinnedByClass(self):
+        result = taeper.run_profile(self.index, bin_secs=60.0)
+        self.assertListEqual(result['bin_starts'].tolist(),
+                             [0.0, 60.0, 120.0, 180.0])
+        self.assertListEqual(result['reads'].tolist(), [3, 0, 1, 1])
+        self.assertListEqual(result['cumulative_reads'].tolist(),
+                             [3, 3, 4, 5])
+        self.assertListEqual(result['pass'].tolist(), [2, 0, 1, 0])
+        self.assertListEqual(result['fail'].tolist(), [1, 0, 0, 0])
+        self.assertListEqual(result['unclassified'].tolist(), [0, 0, 0, 1])
+        self.assertEqual(result['duration'], 200.0)
+
+    def test_GeneralCase_InterArrivalSummary(self):
+        result = taeper.run_profile(self.index)['inter_arrival']
+        self.assertEqual(result['mean'], 50.0)
+        self.assertEqual(result['p50'], 47.5)
+        self.assertEqual(result['max'], 95.0)
+
+    def test_FormatCsv_HeaderAndOneRowPerBin(self):
+        profile = taeper.run_profile(self.index, bin_secs=60.0)
+        result = taeper.format_profile(profile, csv=True).splitlines()
+        self.assertEqual(result[0], ','.join(taeper.PROFILE_COLUMNS))
+        self.assertEqual(result[1], '0.0,3,3,0,2,1')
+        self.assertEqual(len(result), 5)
+
+    def test_EmptyIndex_EmptyProfile(self):
+        result = taeper.run_profile(taeper.build_index([], []))
+        self.assertEqual(len(result['reads']), 0)
+        self.assertDictEqual(result['inter_arrival'], {})
+
+
+class TestAmplifySchedule(unittest.TestCase):
+    """Test the scheduling of amplified reads"""
+
+    def setUp(self):
+        self.timestamps = np.array([10.0, 20.0, 30.0])
+
+    def test_NoAmplification_OriginalSchedule(self):
+        result = taeper.amplify_schedule(self.timestamps)
+        self.assertListEqual(result.timestamps.tolist(), [10.0, 20.0, 30.0])
+        self.assertListEqual(result.sources.tolist(), [0, 1, 2])
+        self.assertListEqual(result.copies.tolist(), [0, 0, 0])
+
+    def test_NoJitter_CopiesTogetherInCopyOrder(self):
+        result = taeper.amplify_schedule(self.timestamps, factor=2)
+        self.assertListEqual(result.timestamps.tolist(),
+                             [10.0, 10.0, 20.0, 20.0, 30.0, 30.0])
+        self.assertListEqual(result.sources.tolist(), [0, 0, 1, 1, 2, 2])
+        self.assertListEqual(result.copies.tolist(), [0, 1, 0, 1, 0, 1])
+
+    def test_Jitter_ExtraCopiesWithinJitterOfOriginal(self):
+        result = taeper.amplify_schedule(self.timestamps, factor=3,
+                                         jitter=2.0, seed=1)
+        self.assertEqual(len(result.timestamps), 9)
+        self.assertTrue(np.all(np.diff(result.timestamps) >= 0))
+        moved = np.abs(result.timestamps - self.timestamps[result.sources])
+        self.assertTrue(np.all(moved[result.copies == 0] == 0))
+        self.assertTrue(np.all(moved <= 2.0))
+
+    def test_SameSeed_SameSchedule(self):
+        first = taeper.amplify_schedule(self.timestamps, 3, 2.0, seed=7)
+        second = taeper.amplify_schedule(self.timestamps, 3, 2.0, seed=7)
+        self.assertListEqual(first.timestamps.tolist(),
+                             second.timestamps.tolist())
+
+
+class TestAmplifiedDeposit(unittest.TestCase):
+    """Test depositing the extra copies of a read"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_filepath = os.path.join(self.tmpdir.name, 'read9.fast5')
+        shutil.copy2('tests/data/pass/read9.fast5', self.input_filepath)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_AmplifiedFilepath_CopyNumberAddedToName(self):
+        filepath = pathlib.Path('out/pass/read9.fast5')
+        result = taeper.amplified_filepath(filepath, 2)
+        expected = pathlib.Path('out/pass/read9_amp2.fast5')
+        self.assertEqual(result, expected)
+        self.assertEqual(taeper.amplified_filepath(filepath, 0), filepath)
+
+    def test_TemporaryFilepath_HiddenWithoutFast5Extension(self):
+        filepath = pathlib.Path('out/pass/read9_amp2.fast5')
+        result = taeper.temporary_filepath(filepath)
+        expected = pathlib.Path('out/pass/.read9_amp2.fast5.tmp')
+        self.assertEqual(result, expected)
+
+    def test_Hardlink_SharesInode(self):
+        output_filepath = pathlib.Path(self.tmpdir.name, 'out', 'r.fast5')
+        result = taeper.link_deposit(self.input_filepath, output_filepath,
+                                     'hardlink')
+        self.assertTrue(result)
+        self.assertTrue(os.path.samefile(self.input_filepath,
+                                         output_filepath))
+
+    def test_Reflink_SameContentNotHardlinked(self):
+        output_filepath = pathlib.Path(self.tmpdir.name, 'out', 'r.fast5')
+        result = taeper.link_deposit(self.input_filepath, output_filepath,
+                                     'reflink')
+        self.assertFalse(result)
+        self.assertFalse(os.path.samefile(self.input_filepath,
+                                          output_filepath))
+        with open(self.input_filepath, 'rb') as original:
+            expected = original.read()
+        self.assertEqual(output_filepath.read_bytes(), expected)
+
+    def test_RewriteReadId_NewDeterministicId(self):
+        original_id = taeper.fast5.Fast5File(self.input_filepath).get_read_id()
+        copies = []
+        for name in ('a.fast5', 'b.fast5'):
+            filepath = pathlib.Path(self.tmpdir.name, name)
+            shutil.copy2(self.input_filepath, filepath)
+            taeper.rewrite_read_id(filepath, 1)
+            copies.append(taeper.fast5.Fast5File(str(filepath)).get_read_id())
+        self.assertNotEqual(copies[0], original_id)
+        self.assertEqual(copies[0], copies[1])
+
+
+class TestAmplifiedReplay(unittest.TestCase):
+    """Test replaying reads with amplification end to end"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, 'out')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def replay_args(self, input_dir, method='reflink'):
+        return argparse.Namespace(
+            input_dir=input_dir, output=self.output, scale=1e12, amplify=3,
+            amplify_jitter=0.0, amplify_method=method, seed=None,
+            prefetch_reads=0, prefetch_secs=0.0, no_progress_bar=True)
+
+    def assertAmplified(self, output):
+        for read in ('pass/read9', 'fail/read0'):
+            read_ids = set()
+            for suffix in ('', '_amp1', '_amp2'):
+                filepath = os.path.join(output, read + suffix + '.fast5')
+                read_ids.add(taeper.fast5.Fast5File(filepath).get_read_id())
+            self.assertEqual(len(read_ids), 3)
+        leftover = [name for _, _, names in os.walk(output)
+                    for name in names if name.endswith('.tmp')]
+        self.assertListEqual(leftover, [])
+
+    def test_ReplayDirectory_CopiesWithUniqueReadIds(self):
+        index_ = taeper.generate_index('tests/data')
+        taeper.simulate_read_generation(self.replay_args('tests/data'),
+                                        index_)
+        self.assertAmplified(self.output)
+
+    def test_ReplayArchive_CopiesWithUniqueReadIds(self):
+        archive_path = os.path.join(self.tmpdir.name, 'run.tar')
+        with tarfile.open(archive_path, 'w') as tar:
+            tar.add('tests/data', arcname='data')
+        index_ = taeper.generate_index(archive_path)
+        taeper.simulate_read_generation(self.replay_args(archive_path),
+                                        index_)
+        self.assertAmplified(os.path.join(self.output, 'data'))
+
+    def test_ReplayArchiveByHardlink_CopiesWithUniqueReadIds(self):
+        archive_path = os.path.join(self.tmpdir.name, 'run.tar')
+        with tarfile.open(archive_path, 'w') as tar:
+            tar.add('tests/data', arcname='data')
+        index_ = taeper.generate_index(archive_path)
+        taeper.simulate_read_generation(
+            self.replay_args(archive_path, method='hardlink'), index_)
+        self.assertAmplified(os.path.join(self.output, 'data'))
+
+    def test_ReplayDirectoryByHardlink_LinkedOrUniqueReadId(self):
+        input_dir = os.path.join(self.tmpdir.name, 'data')
+        shutil.copytree('tests/data', input_dir)
+        index_ = taeper.generate_index(input_dir)
+        taeper.simulate_read_generation(
+            self.replay_args(input_dir, method='hardlink'), index_)
+        original = os.path.join(input_dir, 'pass/read9.fast5')
+        original_id = taeper.fast5.Fast5File(original).get_read_id()
+        for copy_num in (1, 2):
+            filepath = os.path.join(self.output,
+                                    'pass/read9_amp{}.fast5'.format(copy_num))
+            read_id = taeper.fast5.Fast5File(filepath).get_read_id()
+            # a copy either is a hardlink or has a new read ID, never both
+            self.assertNotEqual(os.path.samefile(original, filepath),
+                                read_id != original_id)
+
+
+class TestSimulateReadGeneration(unittest.TestCase):
+    """Test depositing the reads of an index"""
+
+    def test_EmptyIndex_NothingDeposited(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args = argparse.Namespace(
+                input_dir='tests/data', output=os.path.join(tmpdir, 'out'),
+                scale=1.0, amplify=1, amplify_jitter=0.0,
+                amplify_method='reflink', seed=None, prefetch_reads=0,
+                prefetch_secs=0.0, no_progress_bar=True)
+            taeper.simulate_read_generation(args, taeper.build_index([], []))
+            self.assertFalse(os.path.exists(args.output))